@@ -1,5 +1,35 @@
+import os
+
 from flask import Flask
 
+
+def load_secret_key(path):
+    """
+    Return the key stored at `path`, creating it the first time. Every
+    worker serving the application reads the same key, so a session
+    signed by one of them is accepted by the others.
+    """
+    if not os.path.exists(path):
+        # written aside and linked into place, so a worker starting at
+        # the same time never reads a partial key
+        temporary = '{}.{}'.format(path, os.getpid())
+        with os.fdopen(os.open(temporary, os.O_WRONLY | os.O_CREAT, 0o600), 'wb') as f:
+            f.write(os.urandom(32))
+        try:
+            os.link(temporary, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
 app = Flask(__name__)
+# voter sessions are kept in signed cookies, set SECRET_KEY to share
+# the key between machines
+app.secret_key = os.environ.get('SECRET_KEY') or load_secret_key(
+    os.environ.get('SECRET_KEY_FILE', 'secret_key'))
+app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
-from app import views
\ No newline at end of file
+from app import views
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import requests
+
+from peer_client import PeerClient
+
+
+class NodePool:
+    """
+    The blockchain nodes the application talks to.
+
+    Reads go to the healthy node that has been answering fastest and
+    move on to the next one if it fails. Writes stick to the first
+    configured node that is up, so a voter's ballot and the registry
+    check before it hit the same node, and only fail over when it can't
+    be reached. Every call is bounded by a deadline across retries.
+
+    Reads of results that only change with new blocks can be cached:
+    they are served from memory for `cache_ttl` seconds, then checked
+    again with the ETag the node gave them, so between blocks a node
+    only answers 304.
+    """
+
+    # how long a call may take across all the nodes it tries, in seconds
+    deadline = 15
+    # how long a cached read is served without asking a node, in seconds
+    cache_ttl = 2
+
+    def __init__(self, nodes, client=None):
+        if not nodes:
+            raise Exception("At least one node address is required!!")
+        self.nodes = [node.rstrip('/') + '/' for node in nodes]
+        # sessions, latency and backoff of every node
+        self.client = client or PeerClient()
+        self.lock = threading.Lock()
+        # (path, params) -> (response, time it was last checked)
+        self.cache = {}
+
+    def _available(self):
+        nodes = [node for node in self.nodes if self.client.is_available(node)]
+        # every node is backed off, try them anyway rather than failing
+        return nodes or list(self.nodes)
+
+    def _read_order(self):
+        # nodes without a measurement yet go first so they get one
+        return sorted(self._available(),
+                      key=lambda node: self.client.latency.get(node, 0))
+
+    def _write_order(self):
+        return self._available()
+
+    def _call(self, nodes, method, path, retry_on, **kwargs):
+        started = time.time()
+        last_error = None
+        for node in nodes:
+            remaining = self.deadline - (time.time() - started)
+            if remaining <= 0:
+                break
+            connect, read = self.client.timeout
+            kwargs['timeout'] = (min(connect, remaining), min(read, remaining))
+            try:
+                return self.client.request(method, node, path, **kwargs)
+            except retry_on as e:
+                last_error = e
+        raise last_error or requests.Timeout("No node answered in time")
+
+    def read(self, method, path, **kwargs):
+        """
+        Send a request that doesn't change any state, e.g. /count_vote or
+        /verify_vote, to the fastest healthy node.
+        """
+        return self._call(self._read_order(), method, path,
+                          requests.RequestException, **kwargs)
+
+    def write(self, method, path, **kwargs):
+        """
+        Send a request to the primary node. Another node is only tried if
+        the request could not be delivered, so a ballot that may already
+        have been accepted is never submitted twice.
+        """
+        return self._call(self._write_order(), method, path,
+                          requests.ConnectionError, **kwargs)
+
+    def cached_read(self, path, params=None):
+        """
+        GET `path` like `read`, reusing the last response until the node
+        reports that the chain tip, and so its ETag, has changed.
+        """
+        key = (path, tuple(sorted((params or {}).items())))
+        with self.lock:
+            cached, checked_at = self.cache.get(key, (None, 0))
+        if cached is not None and time.time() - checked_at < self.cache_ttl:
+            return cached
+
+        headers = {}
+        if cached is not None:
+            headers['If-None-Match'] = cached.headers['ETag']
+        response = self.read('GET', path, params=params, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            response = cached
+        elif response.status_code != 200 or 'ETag' not in response.headers:
+            return response
+
+        with self.lock:
+            self.cache[key] = (response, time.time())
+        return response
@@ -1,32 +1,42 @@
 import datetime
+import os
 import time
 import json
 
 import requests
-from flask import Flask, flash, render_template, redirect, request, url_for
+from flask import Flask, flash, render_template, redirect, request, session, url_for
 
 from app import app
+from app.node_pool import NodePool
+
+# The nodes with which our application interacts, as a comma separated
+# list. Votes go to the first one that is up, reads to the fastest.
+NODE_ADDRESSES = [address.strip() for address in
+                  os.environ.get('NODE_ADDRESSES', "http://127.0.0.1:8000").split(',')]
+nodes = NodePool(NODE_ADDRESSES)
+CONNECTED_NODE_ADDRESS = NODE_ADDRESSES[0]
+# The polling venue this application serves, recorded with every vote
+VENUE_ID = os.environ.get('VENUE_ID')
+
+# The state of each voter (`uid`, `has_voted`, `success` and `error`)
+# is kept in their signed session cookie, so any worker can serve them.
+
+
+def is_login():
+    return 'uid' in session
 
-# The node with which our application interacts, there can be multiple
-# such nodes as well.
-CONNECTED_NODE_ADDRESS = "http://127.0.0.1:8000"
-is_login = False
-uid = None
-has_voted = False
-success = None
-error = None
 
 @app.route('/')
 def index():
-    if is_login:
+    if is_login():
         return render_template('index.html',
                            title='YourEvote: A Decentralized '
                                  'Verifiable E-Vote System',
                            node_address=CONNECTED_NODE_ADDRESS,
                            readable_time=timestamp_to_string, 
-                           has_voted = has_voted,
-                           success= success,
-                           error=error)
+                           has_voted = session.get('has_voted', False),
+                           success= session.get('success'),
+                           error=session.get('error'))
     else:    
         return redirect(url_for('login'))
 
@@ -36,29 +46,26 @@ def login():
     """
     Endpoint to create a new transaction via our application.
     """
-    global is_login
-    global uid
     error = None
     if request.method == "POST":
         post_object = {
             'uid': request.form["uid"]
         }
 
-        # Submit a login
-        new_tx_address = "{}/login".format(CONNECTED_NODE_ADDRESS)
-
+        # Submit a login, to the node the vote will be sent to
         try:
-            response = requests.post(new_tx_address,
+            response = nodes.write('POST', 'login',
                     json=post_object,
                     headers={'Content-type': 'application/json'})
         
             if response.status_code == 200:
-                is_login = True
-                uid = request.form["uid"]
+                session.clear()
+                session['uid'] = request.form["uid"]
+                session['has_voted'] = False
                 return redirect(url_for('index'))
             else: 
                 error = "This account has voted before"
-        except requests.ConnectionError:
+        except requests.RequestException:
             error = "Unable to connect to the server"
     
     return render_template('login.html',
@@ -75,63 +82,64 @@ def timestamp_to_string(epoch_time):
 def vote():
     error = None
     success = None
-    global has_voted
 
-    if (not is_login):
+    if (not is_login()):
         return redirect(url_for('login'))
     
     if request.method == "POST":
         name = request.form["name"]
         voted_candidate = request.form["voted_candidate"]
-        # timestamp = time.time()
 
         post_object = {
-            'uid': uid,
+            'uid': session['uid'],
             'name': name,
-            'voted_candidate': voted_candidate
+            'voted_candidate': voted_candidate,
+            'timestamp': time.time()
         }
+        if VENUE_ID:
+            post_object['venue_id'] = VENUE_ID
         
         print(post_object['voted_candidate'])
         print(timestamp_to_string)
         # Submit a new transaction
-        new_tx_address = "{}/new_transaction".format(CONNECTED_NODE_ADDRESS)
-
         try:
-            response = requests.post(new_tx_address,
+            response = nodes.write('POST', 'new_transaction',
                     json=post_object,
                     headers={'Content-type': 'application/json'})
         
             if response.status_code == 201:
                 success = response.text
-                has_voted = True
+                session['has_voted'] = True
             else: 
                 error = response.text
-        except requests.ConnectionError:
+        except requests.RequestException:
             error = "Unable to connect to the server"
     
     return render_template('vote.html',
                            title='Vote',
                            node_address=CONNECTED_NODE_ADDRESS,
                            readable_time=timestamp_to_string,
-                           has_voted= has_voted,
-                           uid = uid,
+                           has_voted= session.get('has_voted', False),
+                           uid = session.get('uid'),
                            success = success,
                            error= error)
 
 @app.route('/mine', methods=['GET'])
 def mine():
-    if (not is_login):
+    if (not is_login()):
         return redirect(url_for('login'))  
     
     else:
       error = None
       success = None
-      new_tx_address = "{}/mine".format(CONNECTED_NODE_ADDRESS)
-      response = requests.get(new_tx_address)
-      if response.status_code == 200:
-        success = response.text
-      else:
-        error = response.text
+      try:
+        response = nodes.write('GET', 'mine')
+        if response.status_code == 200:
+          success = response.text
+        else:
+          error = response.text
+      except requests.RequestException:
+        error = "Unable to connect to the server"
       return render_template('mine.html',                            
                             title='Mine',
                             node_address=CONNECTED_NODE_ADDRESS,
@@ -141,18 +149,20 @@ def mine():
 
 @app.route('/count', methods=['GET'])
 def count():
-    if (not is_login):
+    if (not is_login()):
         return redirect(url_for('login'))  
     
     else:
       error = None
       success = None
-      new_tx_address = "{}/count_vote".format(CONNECTED_NODE_ADDRESS)
-      response = requests.get(new_tx_address)
-      if response.status_code == 200:
-        success = response.text
-      else:
-        error = response.text
+      try:
+        response = nodes.cached_read('count_vote')
+        if response.status_code == 200:
+          success = response.text
+        else:
+          error = response.text
+      except requests.RequestException:
+        error = "Unable to connect to the server"
       return render_template('count.html',                            
                             title='Count',
                             node_address=CONNECTED_NODE_ADDRESS,
@@ -165,7 +175,7 @@ def count():
 def verify():
     success = None
     error = None
-    if (not is_login):
+    if (not is_login()):
         return redirect(url_for('login'))
     
     if request.method == "POST":
@@ -173,27 +183,26 @@ def verify():
         merkle_root = request.form["merkle_root"]
         leaf_hash = request.form["leaf_hash"]
 
+        # block index and merkle root are optional, the node can
+        # locate the vote by its hash alone
         post_object = {
-            "block_index": int(block_index),
-            "merkle_root": merkle_root,
+            "block_index": int(block_index) if block_index else None,
+            "merkle_root": merkle_root or None,
             "leaf_hash": leaf_hash
         }
         
-        # Submit a new transaction
-        new_tx_address = "{}/verify_vote".format(CONNECTED_NODE_ADDRESS)
-
         print(json.dumps(post_object))
 
         try:
-            response = requests.post(new_tx_address,
+            response = nodes.read('POST', 'verify_vote',
                     json=post_object,
                     headers={'Content-type': 'application/json'})
         
-            if response.status_code == 200:
+            if response.status_code in (200, 202):
                 success = response.text
             else: 
                 error = response.text		
-        except requests.ConnectionError:
+        except requests.RequestException:
             error = "Unable to connect to the server" 
     return render_template('verify.html',                            
                             title='Verify',
@@ -205,16 +214,6 @@ def verify():
 
 @app.route('/logout', methods=['GET'])
 def logout():
-    global is_login
-    global uid
-    global success
-    global error
-    global has_voted
-
-    is_login = False
-    uid = None
-    success = None
-    error = None
-    has_voted = False
+    session.clear()
 
     return redirect(url_for('login'))
\ No newline at end of file
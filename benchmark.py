@@ -0,0 +1,339 @@
+"""
+Load-test and micro-benchmark harness for the blockchain node.
+
+Workloads drive /new_transaction, /mine, /count_vote, /verify_vote and
+/chain against a node started in-process, against nodes spawned on
+localhost ports (--spawn), or against already running nodes (--node).
+Micro-benchmarks time Block.compute_hash, proof_of_work, the Merkle tree
+build and check_chain_validity for several chain sizes.
+
+Results are printed as JSON, e.g.
+
+    $ python benchmark.py workload --votes 1000 --mine-every 100
+    $ python benchmark.py workload --spawn 3 --concurrency 8
+    $ python benchmark.py micro --sizes 10 100 1000
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+NODE_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'node_server.py')
+# the vote hash in the /new_transaction receipt
+VOTE_HASH = re.compile(r'vote hash: <b>([0-9a-f]{64})</b>')
+
+
+def import_node_server(workdir):
+    """
+    Import node_server with its databases in `workdir`, background
+    mining disabled and a fixed difficulty, so runs don't depend on or
+    touch local state and blocks sealed back to back don't retarget it.
+    """
+    os.environ['AUTO_MINE'] = '0'
+    os.environ['TARGET_BLOCK_SECONDS'] = '0'
+    os.environ['CHAIN_STORE'] = os.path.join(workdir, 'chain.db')
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(NODE_SERVER))
+    import node_server
+    return node_server
+
+
+def percentile(samples, percent):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+class InProcessClient:
+    """
+    Calls a node_server app through Flask's test client, one client per
+    thread.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+        self.size = 1
+
+    def _client(self):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        return self.local.client
+
+    def get(self, path):
+        response = self._client().get(path)
+        return response.status_code, response.get_data()
+
+    def post(self, path, payload):
+        response = self._client().post(path, json=payload)
+        return response.status_code, response.get_data()
+
+
+class HttpClient:
+    """
+    Calls running nodes over HTTP, spreading requests round-robin.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = [node.rstrip('/') for node in nodes]
+        self.size = len(self.nodes)
+        self.session = requests.Session()
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def _node(self):
+        with self.lock:
+            self.counter += 1
+            return self.nodes[self.counter % len(self.nodes)]
+
+    def get(self, path):
+        response = self.session.get(self._node() + path, timeout=60)
+        return response.status_code, response.content
+
+    def post(self, path, payload):
+        response = self.session.post(self._node() + path, json=payload, timeout=60)
+        return response.status_code, response.content
+
+
+def spawn_nodes(count, base_port, workdir):
+    """
+    Start `count` nodes on consecutive localhost ports, each with its own
+    databases, and register the others with the first one.
+    """
+    processes = []
+    nodes = []
+    for offset in range(count):
+        port = base_port + offset
+        node_dir = os.path.join(workdir, str(port))
+        os.makedirs(node_dir)
+        env = dict(os.environ, FLASK_APP=NODE_SERVER, AUTO_MINE='0',
+                   TARGET_BLOCK_SECONDS='0',
+                   CHAIN_STORE=os.path.join(node_dir, 'chain.db'))
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'flask', 'run', '--port', str(port)],
+            cwd=node_dir, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        nodes.append('http://127.0.0.1:{}'.format(port))
+
+    for node in nodes:
+        for _ in range(100):
+            try:
+                requests.get(node + '/tip', timeout=1)
+                break
+            except requests.RequestException:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError('Node {} did not start'.format(node))
+
+    for node in nodes[1:]:
+        requests.post(node + '/register_with', json={'node_address': nodes[0]},
+                      timeout=60)
+    return processes, nodes
+
+
+class Recorder:
+    """
+    Collects per-operation latencies, errors and the wall time spent in
+    each operation's phases, from which throughput is derived.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.wall_time = {}
+
+    def call(self, operation, function, *args):
+        started = time.perf_counter()
+        try:
+            status, body = function(*args)
+        except requests.RequestException:
+            status, body = None, b''
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.latencies.setdefault(operation, []).append(elapsed)
+            if status is None or status >= 400:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+        return status, body
+
+    def phase(self, executor, operation, function, items):
+        """
+        Run `function` over `items` concurrently as one timed phase.
+        """
+        started = time.perf_counter()
+        results = list(executor.map(function, items))
+        self.wall_time[operation] = self.wall_time.get(operation, 0) + \
+            time.perf_counter() - started
+        return results
+
+    def report(self):
+        return {operation: {
+                    "count": len(latencies),
+                    "errors": self.errors.get(operation, 0),
+                    "throughput": len(latencies) / self.wall_time[operation],
+                    "p50_ms": percentile(latencies, 50) * 1000,
+                    "p99_ms": percentile(latencies, 99) * 1000}
+                for operation, latencies in self.latencies.items()}
+
+
+def run_workload(client, args):
+    rng = random.Random(args.seed)
+    candidates = ['candidate-{}'.format(number) for number in range(args.candidates)]
+    # drawn up front so the ballots don't depend on thread scheduling
+    choices = [rng.choice(candidates) for _ in range(args.votes)]
+    run_id = int(time.time())
+    recorder = Recorder()
+    vote_hashes = []
+
+    def cast(number):
+        ballot = {'uid': 'bench-{}-{}'.format(run_id, number),
+                  'name': 'voter {}'.format(number),
+                  'voted_candidate': choices[number]}
+        status, body = recorder.call('new_transaction', client.post,
+                                     '/new_transaction', ballot)
+        receipt = VOTE_HASH.search(body.decode(errors='replace'))
+        if status == 201 and receipt:
+            vote_hashes.append(receipt.group(1))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for batch_start in range(0, args.votes, args.mine_every):
+            batch = range(batch_start, min(batch_start + args.mine_every, args.votes))
+            recorder.phase(executor, 'new_transaction', cast, batch)
+            # one /mine per node, so every node seals its own pending votes
+            recorder.phase(executor, 'mine',
+                           lambda _: recorder.call('mine', client.get, '/mine'),
+                           range(client.size))
+            recorder.phase(executor, 'count_vote',
+                           lambda _: recorder.call('count_vote', client.get, '/count_vote'),
+                           range(args.polls))
+
+        receipts = rng.sample(vote_hashes, min(args.verifies, len(vote_hashes)))
+        recorder.phase(executor, 'verify_vote',
+                       lambda leaf_hash: recorder.call('verify_vote', client.post,
+                                                       '/verify_vote',
+                                                       {'leaf_hash': leaf_hash}),
+                       receipts)
+        recorder.phase(executor, 'chain',
+                       lambda _: recorder.call('chain', client.get, '/chain'),
+                       range(args.chain_reads))
+
+    return {"elapsed": time.perf_counter() - started,
+            "operations": recorder.report()}
+
+
+def time_call(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat
+
+
+def run_micro(node_server, args):
+    Block, Blockchain = node_server.Block, node_server.Blockchain
+    rng = random.Random(args.seed)
+    results = []
+
+    for size in args.sizes:
+        blockchain = Blockchain()
+        blockchain.create_genesis_block()
+        pow_durations = []
+        for index in range(size):
+            for number in range(args.transactions):
+                blockchain.add_new_transaction({
+                    'uid': '{}-{}'.format(index, number),
+                    'name': 'voter',
+                    'voted_candidate': rng.choice(['Apple', 'Banana'])})
+            batch = blockchain.mempool.peek(args.transactions, sys.maxsize)
+            block = Block.from_encoded(index=blockchain.last_block.index + 1,
+                                       encoded_transactions=[encoded for _, encoded in batch],
+                                       leaf_hashes=[tx_hash for tx_hash, _ in batch],
+                                       timestamp=time.time(),
+                                       previous_hash=blockchain.last_block.hash,
+                                       difficulty=Blockchain.required_difficulty(
+                                           blockchain.chain, blockchain.last_block.index + 1))
+            block.state_hash = blockchain.next_state(block)[2]
+            started = time.perf_counter()
+            proof = Blockchain.proof_of_work(block)
+            pow_durations.append(time.perf_counter() - started)
+            blockchain.add_block(block, proof)
+
+        block = blockchain.last_block
+        results.append({
+            "chain_size": size,
+            "transactions_per_block": args.transactions,
+            "compute_hash_ms": time_call(block.compute_hash, args.repeat) * 1000,
+            "proof_of_work_ms": sum(pow_durations) / len(pow_durations) * 1000,
+            "merkle_tree_ms": time_call(block.build_merkle_tree, args.repeat) * 1000,
+            "check_chain_validity_ms": time_call(
+                lambda: Blockchain.check_chain_validity(blockchain.chain), 1) * 1000,
+        })
+    return {"difficulty": Blockchain.difficulty, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report to this file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    workload = subparsers.add_parser('workload', help='drive the HTTP endpoints')
+    workload.add_argument('--node', action='append', default=[],
+                          help='address of a running node, can be repeated')
+    workload.add_argument('--spawn', type=int, default=0,
+                          help='number of nodes to start on localhost')
+    workload.add_argument('--base-port', type=int, default=8100)
+    workload.add_argument('--votes', type=int, default=500)
+    workload.add_argument('--mine-every', type=int, default=50)
+    workload.add_argument('--polls', type=int, default=10,
+                          help='/count_vote calls after every block')
+    workload.add_argument('--verifies', type=int, default=100)
+    workload.add_argument('--chain-reads', type=int, default=10)
+    workload.add_argument('--candidates', type=int, default=2)
+    workload.add_argument('--concurrency', type=int, default=4)
+
+    micro = subparsers.add_parser('micro', help='time the hot functions')
+    micro.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    micro.add_argument('--transactions', type=int, default=10,
+                       help='transactions per block')
+    micro.add_argument('--repeat', type=int, default=100)
+
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix='e-vote-bench-')
+    output = os.path.abspath(args.output) if args.output else None
+    report = {"command": args.command, "config": vars(args)}
+
+    if args.command == 'micro':
+        report["micro"] = run_micro(import_node_server(workdir), args)
+    elif args.node:
+        report["workload"] = run_workload(HttpClient(args.node), args)
+    elif args.spawn:
+        processes, nodes = spawn_nodes(args.spawn, args.base_port, workdir)
+        try:
+            report["workload"] = run_workload(HttpClient(nodes), args)
+        finally:
+            for process in processes:
+                process.terminate()
+    else:
+        report["workload"] = run_workload(
+            InProcessClient(import_node_server(workdir).app), args)
+
+    report_json = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as report_file:
+            report_file.write(report_json)
+    print(report_json)
+
+
+if __name__ == '__main__':
+    main()
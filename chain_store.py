@@ -0,0 +1,150 @@
+import json
+import sqlite3
+import threading
+
+from metrics import SQLITE_SECONDS
+import wire
+
+
+class ChainStore:
+    """
+    Append-only on-disk log of the blocks accepted by a node, kept in a
+    SQLite table keyed by block index.
+
+    Every block is stored as its binary record (see `wire`) along with
+    its vote hashes and the tally and voter digest of the chain once it
+    was appended. The checkpoint records the height and hash up to which
+    the stored blocks have already been verified, and the vote stats as
+    of that height, so a restarted node takes the blocks up to it as
+    they are and only re-verifies and re-indexes the blocks written
+    after it. A node that joined from a snapshot keeps it here along
+    with the headers it was checked against, and only stores the blocks
+    after it.
+    """
+
+    # number of appended blocks after which the checkpoint moves forward
+    checkpoint_interval = 100
+
+    def __init__(self, path='chain.db'):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        columns = [row[1] for row in
+                   self.connection.execute('PRAGMA table_info(BLOCKS)')]
+        if columns and 'leaves' not in columns:
+            # blocks written in an older format, they are synced again
+            self.connection.execute('DROP TABLE BLOCKS')
+            self.connection.execute('DROP TABLE IF EXISTS CHECKPOINT')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS BLOCKS
+               (idx INTEGER PRIMARY KEY,
+               hash          TEXT    NOT NULL,
+               data          BLOB    NOT NULL,
+               leaves        BLOB    NOT NULL,
+               tally         TEXT    NOT NULL,
+               voter_digest  TEXT    NOT NULL);''')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS CHECKPOINT
+               (id INTEGER PRIMARY KEY CHECK (id = 0),
+               height        INTEGER NOT NULL,
+               hash          TEXT    NOT NULL,
+               stats         TEXT    NOT NULL);''')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS SNAPSHOT
+               (id INTEGER PRIMARY KEY CHECK (id = 0),
+               height        INTEGER NOT NULL,
+               data          TEXT    NOT NULL);''')
+        self.connection.commit()
+
+    @property
+    def checkpoint(self):
+        """
+        Return the (height, hash, vote stats rows) of the last verified
+        block, or (0, None, None) when nothing has been checkpointed yet.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT height, hash, stats FROM CHECKPOINT WHERE id = 0').fetchone()
+        return (row[0], row[1], json.loads(row[2])) if row else (0, None, None)
+
+    def set_checkpoint(self, block, stats=None):
+        """
+        Move the checkpoint to `block`, the tip of the chain whose vote
+        stats are `stats`, or drop it if `block` is None.
+        """
+        with self.lock:
+            self.connection.execute('DELETE FROM CHECKPOINT')
+            if block is not None:
+                self.connection.execute(
+                    'INSERT INTO CHECKPOINT(id, height, hash, stats) VALUES (0, ?, ?, ?)',
+                    (block.index, block.hash, json.dumps(stats.rows())))
+            self.connection.commit()
+
+    @property
+    def snapshot(self):
+        """
+        Return the (snapshot, headers) the chain was bootstrapped from,
+        or None if it holds every block.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT data FROM SNAPSHOT WHERE id = 0').fetchone()
+        return tuple(json.loads(row[0])) if row else None
+
+    def set_snapshot(self, base_snapshot):
+        with self.lock:
+            self.connection.execute('DELETE FROM SNAPSHOT')
+            if base_snapshot is not None:
+                snapshot, headers = base_snapshot
+                self.connection.execute(
+                    'INSERT INTO SNAPSHOT(id, height, data) VALUES (0, ?, ?)',
+                    (snapshot['height'], json.dumps([snapshot, headers])))
+            self.connection.commit()
+
+    def append(self, block, tally, voter_digest, stats):
+        """
+        Write a block that has just been accepted by the chain, with the
+        tally, voter digest and vote stats of the chain it leads to.
+        """
+        self.extend([(block, tally, voter_digest)], stats)
+
+    def extend(self, entries, stats):
+        """
+        Write the (block, tally, voter digest) of consecutive blocks up to
+        the tip of the chain, whose vote stats are `stats`.
+        """
+        with self.lock, SQLITE_SECONDS.time(operation='append_blocks'):
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO BLOCKS(idx, hash, data, leaves, tally, voter_digest) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(block.index, block.hash, block.to_wire(),
+                  b''.join(bytes.fromhex(leaf_hash) for leaf_hash in block.leaf_hashes),
+                  json.dumps(tally), format(voter_digest, 'x'))
+                 for block, tally, voter_digest in entries])
+            self.connection.commit()
+        if entries and entries[-1][0].index - self.checkpoint[0] >= self.checkpoint_interval:
+            self.set_checkpoint(entries[-1][0], stats)
+
+    def truncate(self, height):
+        """
+        Drop every block from `height` onwards, e.g. when the chain is
+        replaced by a longer one that forks at that height.
+        """
+        with self.lock:
+            self.connection.execute('DELETE FROM BLOCKS WHERE idx >= ?', (height,))
+            self.connection.execute(
+                'DELETE FROM CHECKPOINT WHERE height >= ?', (height,))
+            self.connection.commit()
+
+    def iter_blocks(self):
+        """
+        Stream the stored blocks in index order without loading the
+        whole table at once, as (header, encoded transactions, leaf
+        hashes, tally, voter digest). The transactions are not parsed.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT data, leaves, tally, voter_digest FROM BLOCKS ORDER BY idx')
+        for data, leaves, tally, voter_digest in cursor:
+            header, encoded_transactions = wire.decode_block(data)
+            yield (header, encoded_transactions,
+                   [leaves[start:start + 32].hex() for start in range(0, len(leaves), 32)],
+                   json.loads(tally), int(voter_digest, 16))
+        cursor.close()
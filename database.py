@@ -6,11 +6,14 @@ def main():
   conn = sqlite3.connect('test.db')
   print("Opened database successfully")
 
-  conn.execute('''CREATE TABLE USERS
+  conn.execute('''CREATE TABLE IF NOT EXISTS USERS
          (id INTEGER PRIMARY KEY    AUTOINCREMENT,
          uid           TEXT    NOT NULL);''')
   print("Table created successfully")
 
+  conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS USERS_UID ON USERS(uid);''')
+  print("Index created successfully")
+
   conn.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+from collections import OrderedDict
+import json
+import threading
+import time
+
+
+class Mempool:
+    """
+    Unconfirmed transactions keyed by their vote hash, in arrival order.
+
+    The pool is bounded: a transaction is only admitted if its hash is
+    not already pending and the pool isn't full. Miners take batches from
+    the front and remove them once they are on the chain.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.lock = threading.RLock()
+        # vote hash -> (transaction, encoded transaction, admission time)
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self.entries
+
+    def is_full(self):
+        return len(self.entries) >= self.max_size
+
+    @property
+    def transactions(self):
+        with self.lock:
+            return [transaction for transaction, _, _ in self.entries.values()]
+
+    def hashes(self):
+        with self.lock:
+            return list(self.entries)
+
+    def oldest_age(self):
+        """
+        Seconds the oldest pending transaction has been waiting, 0 if
+        the pool is empty.
+        """
+        with self.lock:
+            if not self.entries:
+                return 0
+            _, _, added_at = next(iter(self.entries.values()))
+        return time.time() - added_at
+
+    def add(self, tx_hash, transaction, encoded=None):
+        """
+        Admit a transaction, along with its encoded bytes if the caller
+        already has them. Returns False if it is already pending or the
+        pool is full.
+        """
+        with self.lock:
+            if tx_hash in self.entries or self.is_full():
+                return False
+            if encoded is None:
+                encoded = json.dumps(transaction).encode()
+            self.entries[tx_hash] = (transaction, encoded, time.time())
+            return True
+
+    def peek(self, max_count, max_bytes):
+        """
+        Return the oldest (hash, encoded transaction) pairs that fit in a
+        block of at most `max_count` transactions and `max_bytes` encoded
+        bytes. At least one transaction is returned if the pool isn't empty.
+        """
+        batch = []
+        total_bytes = 0
+        with self.lock:
+            for tx_hash, (_, encoded, _) in self.entries.items():
+                if len(batch) >= max_count or \
+                        (batch and total_bytes + len(encoded) > max_bytes):
+                    break
+                batch.append((tx_hash, encoded))
+                total_bytes += len(encoded)
+        return batch
+
+    def restore(self, entries):
+        """
+        Put back the (hash, transaction, encoded transaction) of votes
+        whose block left the chain, ahead of the pending ones. They are
+        admitted even if the pool is full, their voters are registered
+        already.
+        """
+        with self.lock:
+            for tx_hash, transaction, encoded in reversed(entries):
+                if tx_hash not in self.entries:
+                    self.entries[tx_hash] = (transaction, encoded, time.time())
+                    self.entries.move_to_end(tx_hash, last=False)
+
+    def discard(self, tx_hash):
+        with self.lock:
+            self.entries.pop(tx_hash, None)
@@ -0,0 +1,198 @@
+"""
+Minimal Prometheus-style metrics and a sampling profiler for the node.
+
+Metrics register themselves in a process wide registry when created and
+`render()` returns them in the Prometheus text exposition format.
+"""
+from collections import Counter as Tally
+from contextlib import contextmanager
+import sys
+import threading
+import time
+
+REGISTRY = []
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                          for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        """
+        Return (suffix, labelvalues, extra labels, value) tuples.
+        """
+        with self.lock:
+            return [('', key, (), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for suffix, labelvalues, extra, value in self.samples():
+            lines.append('{}{}{} {}'.format(
+                self.name, suffix, _format_labels(self.labelnames, labelvalues, extra),
+                _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. If `function` is given it is called
+    at render time instead of storing values.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.function is not None:
+            return [('', (), (), self.function())]
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                for bound, count in zip(self.buckets, counts):
+                    samples.append(('_bucket', key, (('le', _format_value(bound)),), count))
+                samples.append(('_sum', key, (), total))
+                samples.append(('_count', key, (), counts[-1]))
+        return samples
+
+
+# shared by every module talking to SQLite
+SQLITE_SECONDS = Histogram('sqlite_query_seconds', 'Latency of SQLite calls',
+                           ('operation',))
+
+
+def render():
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the stack of every other thread and counts the
+    functions found executing, to locate hot spots under live load. It
+    can be started and stopped at runtime.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Tally()
+        self.samples = 0
+        self.interval = 0.01
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self._thread is not None and self._thread.is_alive() and \
+            not self._stop.is_set()
+
+    def start(self, interval=0.01):
+        with self.lock:
+            if self.enabled:
+                return
+            self.interval = interval
+            self.counts = Tally()
+            self.samples = 0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                self.samples += 1
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    code = frame.f_code
+                    self.counts['{}:{} {}'.format(code.co_filename, frame.f_lineno,
+                                                  code.co_name)] += 1
+
+    def top(self, limit=20):
+        with self.lock:
+            return {"enabled": self.enabled,
+                    "interval": self.interval,
+                    "samples": self.samples,
+                    "top": [{"location": location, "count": count}
+                            for location, count in self.counts.most_common(limit)]}
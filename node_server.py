@@ -1,59 +1,349 @@
+from concurrent.futures import ThreadPoolExecutor
+import functools
 from hashlib import sha256
 import json
+import os
+import threading
 import time
-import sqlite3
+import zlib
 
-from flask import Flask, request
+from flask import Flask, Response, g, request
 from merkletools import MerkleTools
 
 import requests
 
+from chain_store import ChainStore
+import metrics
+from mempool import Mempool
+from peer_client import PeerClient
+from proof_of_work import ProofOfWorkEngine, block_prefix, hash_nonce
+import snapshot
+from vote_stats import VoteStats
+from voter_registry import VoterRegistry
+import wire
+
+
+REQUEST_SECONDS = metrics.Histogram(
+    'http_request_seconds', 'Latency of the node endpoints', ('route', 'method'))
+POW_SECONDS = metrics.Histogram(
+    'pow_seconds', 'Duration of proof of work searches',
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+MERKLE_SECONDS = metrics.Histogram(
+    'merkle_build_seconds', 'Time spent building the Merkle tree of a block')
+CONSENSUS_SECONDS = metrics.Histogram(
+    'consensus_round_seconds', 'Duration of a whole consensus round')
+CONSENSUS_PEER_SECONDS = metrics.Histogram(
+    'consensus_peer_sync_seconds', 'Time spent syncing blocks from each peer', ('peer',))
+
+
+def encode_transaction(transaction):
+    """
+    A function that returns the canonical bytes of a transaction, which
+    are hashed into its vote hash, sealed into blocks and sent to peers.
+    """
+    return json.dumps(transaction).encode()
+
+
+# type of every block field received from peers, besides the transactions
+BLOCK_FIELD_TYPES = {"index": int, "timestamp": (int, float), "previous_hash": str,
+                     "difficulty": int, "state_hash": str, "nonce": int, "hash": str}
+
+
+def check_block_fields(block_data):
+    """
+    Raise ValueError unless a block received from a peer, as JSON or as
+    the header of a binary record, has every field with the right type.
+    """
+    if not isinstance(block_data, dict):
+        raise ValueError("A block must be an object")
+    for field, field_type in BLOCK_FIELD_TYPES.items():
+        value = block_data.get(field)
+        if not isinstance(value, field_type) or isinstance(value, bool):
+            raise ValueError("Invalid block field {}".format(field))
+    # JSON blocks carry their transactions, binary headers don't
+    if not isinstance(block_data.get("transactions", []), list):
+        raise ValueError("Invalid block field transactions")
+
+
+def compute_transaction_hash(transaction):
+    """
+    A function that returns the vote hash of a transaction, which is
+    also its leaf hash in the block's Merkle tree.
+    """
+    return sha256(encode_transaction(transaction)).hexdigest()
+
+
+class ChainError(Exception):
+    """
+    Raised when a chain or snapshot received from a peer doesn't check out.
+    """
+
 
 class Block:
-    def __init__(self, index, transactions, timestamp, previous_hash, nonce=0):
+    __slots__ = ('index', 'timestamp', 'previous_hash', 'difficulty', 'state_hash',
+                 'nonce', 'hash', 'encoded_transactions', '_leaf_hashes', '_prefix',
+                 '_merkle', '_merkle_root', '_leaf_positions')
+
+    def __init__(self, index, transactions, timestamp, previous_hash, nonce=0,
+                 difficulty=0, state_hash=None):
         self.index = index
-        self.transactions = transactions
         self.timestamp = timestamp
         self.previous_hash = previous_hash
+        # number of leading zeros the block hash must have, see
+        # `Blockchain.required_difficulty`
+        self.difficulty = difficulty
+        # hash of the tally, voter digest and vote stats once the block
+        # is appended, see `snapshot.state_hash`
+        self.state_hash = state_hash
         self.nonce = nonce
         self.hash = '0'
+        # the transactions are only kept as their canonical bytes, encoded
+        # once here and reused by every hashing and serialization path.
+        # Their leaf hashes are computed on first use, or by the PoW
+        # engine workers when a whole chain is checked
+        self.encoded_transactions = tuple(encode_transaction(trx) for trx in transactions)
+        self._leaf_hashes = None
+        self._prefix = None
+        # Merkle tree of the transactions, built once the block is sealed
+        # (or lazily on first use) and reused for roots and proofs
+        self._merkle = None
+        self._merkle_root = None
+        self._leaf_positions = None
+
+    @classmethod
+    def from_dict(cls, block_data):
+        return cls(block_data["index"],
+                   block_data["transactions"],
+                   block_data["timestamp"],
+                   block_data["previous_hash"],
+                   block_data["nonce"],
+                   block_data["difficulty"],
+                   block_data["state_hash"])
+
+    @classmethod
+    def from_encoded(cls, index, encoded_transactions, leaf_hashes, timestamp,
+                     previous_hash, nonce=0, difficulty=0, state_hash=None):
+        """
+        Create a block from transactions that are already encoded, e.g.
+        taken from the mempool, without encoding or hashing them again.
+        """
+        block = cls(index, (), timestamp, previous_hash, nonce, difficulty, state_hash)
+        block.encoded_transactions = tuple(encoded_transactions)
+        if leaf_hashes is not None:
+            block._leaf_hashes = tuple(leaf_hashes)
+        return block
+
+    @classmethod
+    def from_wire(cls, header, encoded_transactions):
+        """
+        Create a block from a decoded binary record, keeping the received
+        transaction bytes without parsing them.
+        """
+        return cls.from_encoded(header["index"], encoded_transactions, None,
+                                header["timestamp"], header["previous_hash"],
+                                header["nonce"], header["difficulty"],
+                                header["state_hash"])
+
+    @classmethod
+    def from_header(cls, header, leaf_hashes):
+        """
+        Create a pruned block, which only holds the header and vote
+        hashes of a block that came before a snapshot. Its hash can be
+        computed again and it can prove the votes it holds, but its
+        transactions can't be indexed or sent to peers again.
+        """
+        block = cls.from_encoded(header["index"], (), leaf_hashes,
+                                 header["timestamp"], header["previous_hash"],
+                                 header["nonce"], header["difficulty"],
+                                 header["state_hash"])
+        block.encoded_transactions = None
+        block.hash = header["hash"]
+        return block
+
+    @property
+    def pruned(self):
+        return self.encoded_transactions is None
+
+    @property
+    def leaf_hashes(self):
+        if self._leaf_hashes is None:
+            self._leaf_hashes = tuple(sha256(trx).hexdigest()
+                                      for trx in self.encoded_transactions)
+        return self._leaf_hashes
+
+    def set_hashes(self, leaf_hashes, merkle_root):
+        """
+        Keep the leaf hashes and Merkle root computed for this block
+        elsewhere, e.g. by the PoW engine workers.
+        """
+        self._leaf_hashes = tuple(leaf_hashes)
+        self._merkle_root = merkle_root
+
+    @property
+    def transactions(self):
+        return [json.loads(trx) for trx in self.encoded_transactions]
+
+    def to_json(self):
+        """
+        A function that returns the block fields shared with other nodes as
+        JSON bytes, built from the encoded transactions instead of
+        serializing them again.
+        """
+        return b'{"index": %d, "transactions": [%b], "timestamp": %b, ' \
+               b'"previous_hash": %b, "difficulty": %d, "state_hash": %b, ' \
+               b'"nonce": %d, "hash": %b}' % (
+                   self.index, b', '.join(self.encoded_transactions),
+                   json.dumps(self.timestamp).encode(),
+                   json.dumps(self.previous_hash).encode(),
+                   self.difficulty, json.dumps(self.state_hash).encode(),
+                   self.nonce, json.dumps(self.hash).encode())
+
+    def to_wire(self):
+        """
+        A function that returns the block as a binary record, see `wire`.
+        """
+        return wire.encode_block(self.record_header(), self.encoded_transactions)
+
+    def record_header(self):
+        """
+        A function that returns the block fields besides the transactions,
+        as sent in binary records and to the PoW engine workers.
+        """
+        return {"index": self.index,
+                "timestamp": self.timestamp,
+                "previous_hash": self.previous_hash,
+                "difficulty": self.difficulty,
+                "state_hash": self.state_hash,
+                "nonce": self.nonce,
+                "hash": self.hash}
+
+    def header(self):
+        """
+        A function that returns the block fields without its transactions,
+        which are enough to compute the block hash again.
+        """
+        return {"index": self.index,
+                "hash": self.hash,
+                "previous_hash": self.previous_hash,
+                "timestamp": self.timestamp,
+                "difficulty": self.difficulty,
+                "merkle_root": self.merkle_tree(),
+                "state_hash": self.state_hash,
+                "nonce": self.nonce}
+
+    def hashing_prefix(self):
+        """
+        A function that returns the serialized block header up to the
+        nonce. The transactions are covered by their Merkle root, so the
+        hash can be checked from the header alone. The nonce is placed
+        last so that proof of work can hash this prefix once and only
+        vary the tail. The contents don't change once the block is
+        created, so the prefix is cached.
+        """
+        if self._prefix is None:
+            self._prefix = block_prefix(self.index, self.previous_hash, self.timestamp,
+                                        self.difficulty, self.merkle_tree(),
+                                        self.state_hash)
+        return self._prefix
 
     def compute_hash(self):
         """
         A function that return the hash of the block contents.
         """
-        block_string = json.dumps(self.__dict__, sort_keys=True)
-        return sha256(block_string.encode()).hexdigest()
+        return hash_nonce(self.hashing_prefix(), self.nonce)
+
+    def build_merkle_tree(self):
+        """
+        Hash the transactions into a Merkle tree and cache it together
+        with the position of every leaf.
+        """
+        with MERKLE_SECONDS.time():
+            mt = MerkleTools(hash_type="sha256")
+            mt.add_leaf(list(self.leaf_hashes))
+            mt.make_tree()
+        self._merkle = mt
+        self._merkle_root = mt.get_merkle_root()
+        self._leaf_positions = {mt.get_leaf(position): position
+                                for position in range(mt.get_leaf_count())}
+        return mt
 
     def merkle_tree(self):
-        mt = MerkleTools(hash_type="sha256")
-        for trx in self.transactions:
-            trx_string = json.dumps(trx)
-            mt.add_leaf(trx_string, True)
-        mt.make_tree()
-        return mt.get_merkle_root()
+        if self._merkle is None and self._merkle_root is None:
+            self.build_merkle_tree()
+        return self._merkle_root
+
+    def merkle_proof(self, leaf_hash):
+        """
+        Return the inclusion proof of `leaf_hash` from the cached tree,
+        or None if the leaf is not part of this block.
+        """
+        if self._merkle is None:
+            self.build_merkle_tree()
+        position = self._leaf_positions.get(leaf_hash)
+        if position is None:
+            return None
+        return self._merkle.get_proof(position)
 
     def verify_vote(self, leaf_hash, merkle_root):
-        mt = MerkleTools(hash_type="sha256")
-        counter = 0
-        for trx in self.transactions:
-            trx_string = json.dumps(trx)
-            mt.add_leaf(trx_string, True)
-            if(mt.get_leaf(counter) == leaf_hash):
-                break
-            counter += 1
-        mt.make_tree()
+        proof = self.merkle_proof(leaf_hash)
+        if proof is None:
+            return False
         if merkle_root is None:
-            merkle_root = mt.get_merkle_root()
-        return mt.validate_proof(mt.get_proof(counter), leaf_hash, merkle_root) # True
+            merkle_root = self._merkle.get_merkle_root()
+        try:
+            return self._merkle.validate_proof(proof, leaf_hash, merkle_root)
+        except (ValueError, TypeError):
+            # merkle_root or leaf_hash is not a hex digest
+            return False
 
 class Blockchain:
-    # difficulty of our PoW algorithm
+    # difficulty of our PoW algorithm, as recorded in the genesis block.
+    # Every `retarget_interval` blocks it moves one step towards sealing
+    # a block every `target_block_seconds` (0 keeps it fixed), within
+    # [min_difficulty, max_difficulty]. Every node of a network must use
+    # the same settings, see DIFFICULTY below.
     difficulty = 2
-
-    def __init__(self):
-        self.unconfirmed_transactions = []
+    target_block_seconds = 10
+    retarget_interval = 10
+    min_difficulty = 1
+    max_difficulty = 8
+    # how far ahead of our clock a block timestamp may be, in seconds.
+    # Timestamps must also increase from block to block, so a miner
+    # can't fake the intervals the difficulty is retargeted on
+    max_clock_drift = 120
+    # shared nonce search engine, spreads hard searches over all cores
+    pow_engine = ProofOfWorkEngine()
+    # caps on the transactions sealed into a single block
+    max_block_transactions = 500
+    max_block_bytes = 1000000
+    # snapshots are taken every `snapshot_interval` blocks, at least
+    # `snapshot_confirmations` blocks below the tip
+    snapshot_interval = 1000
+    snapshot_confirmations = 10
+
+    def __init__(self, store=None):
+        # unconfirmed transactions, keyed by vote hash
+        self.mempool = Mempool()
+        self.mining_lock = threading.Lock()
         self.chain = []
+        # vote hash -> (block index, leaf position) of confirmed transactions
+        self.leaf_index = {}
+        # cumulative vote count per candidate, one entry per block height
+        self.tally_history = []
+        # cumulative digest of the voter uids, one entry per block height
+        self.voter_digests = []
+        # vote counts per venue, candidate and time bucket
+        self.stats = VoteStats()
+        # blocks up to this height are pruned, the chain was bootstrapped
+        # from the (snapshot, headers) in `base_snapshot`
+        self.pruned_height = 0
+        self.base_snapshot = None
+        self._snapshot = None
+        # optional ChainStore the accepted blocks are appended to
+        self.store = store
+        # optional VoterRegistry the uids of confirmed votes are added to,
+        # so a node knows who has voted through other nodes
+        self.registry = None
 
     def create_genesis_block(self):
         """
@@ -61,14 +351,120 @@ class Blockchain:
         the chain. The block has index 0, previous_hash as 0, and
         a valid hash.
         """
-        genesis_block = Block(0, [], 0, "0")
-        genesis_block.hash = genesis_block.compute_hash()
+        genesis_block = self.genesis_block()
         self.chain.append(genesis_block)
+        self.index_block(genesis_block)
+
+    @classmethod
+    def genesis_block(cls):
+        genesis_block = Block(0, [], 0, "0", difficulty=cls.difficulty,
+                              state_hash=snapshot.state_hash({}, 0, 0))
+        genesis_block.hash = genesis_block.compute_hash()
+        return genesis_block
+
+    @classmethod
+    def required_difficulty(cls, chain, index):
+        """
+        Return the difficulty the block at `index` must have, given the
+        blocks before it in `chain`. It is the difficulty of the previous
+        block, retargeted every `retarget_interval` blocks: one more zero
+        if the last blocks were sealed more than 4 times faster than
+        `target_block_seconds`, one less if more than 4 times slower. A
+        zero is 16 times the work, so this settles within a factor of 4
+        of the target. The genesis block's timestamp is not a real one,
+        it is left out of the measurement.
+        """
+        previous = chain[index - 1]
+        start = index - 1 - cls.retarget_interval
+        if not cls.target_block_seconds or index % cls.retarget_interval or start < 1:
+            return previous.difficulty
+        average = (previous.timestamp - chain[start].timestamp) / cls.retarget_interval
+        if average * 4 < cls.target_block_seconds:
+            return min(previous.difficulty + 1, cls.max_difficulty)
+        if average > cls.target_block_seconds * 4:
+            return max(previous.difficulty - 1, cls.min_difficulty)
+        return previous.difficulty
+
+    @classmethod
+    def is_valid_timestamp(cls, chain, block):
+        """
+        Check that the block at `block.index` of `chain` was sealed after
+        the block before it and not too far in the future.
+        """
+        return chain[block.index - 1].timestamp < block.timestamp <= \
+            time.time() + cls.max_clock_drift
 
     @property
     def last_block(self):
         return self.chain[-1]
 
+    @property
+    def tally(self):
+        return self.tally_history[-1] if self.tally_history else {}
+
+    def tally_at(self, height):
+        """
+        Return the vote count per candidate as it was once the block
+        at `height` was appended, or None if there is no such block or
+        it came before the snapshot the chain was bootstrapped from.
+        """
+        if height < 0 or height >= len(self.tally_history):
+            return None
+        return self.tally_history[height]
+
+    def next_state(self, block):
+        """
+        Return the (tally, voter digest, state hash) of the chain once
+        `block` is appended, along with its decoded transactions and the
+        uids of its voters, without changing anything. Raises ValueError
+        if the transactions can't be indexed. Only votes for a candidate
+        given as a string are counted.
+        """
+        transactions = block.transactions
+        counts = dict(self.tally)
+        voter_digest = self.voter_digests[-1] if self.voter_digests else 0
+        uids = []
+        for transaction in transactions:
+            if not isinstance(transaction, dict):
+                raise ValueError("Block {} holds a transaction that is not an "
+                                 "object".format(block.index))
+            if 'uid' in transaction:
+                voter_digest = snapshot.add_voter(voter_digest, transaction['uid'])
+                if isinstance(transaction['uid'], str):
+                    uids.append(transaction['uid'])
+            voted_candidate = transaction.get('voted_candidate')
+            if not isinstance(voted_candidate, str):
+                continue
+            counts[voted_candidate] = counts.get(voted_candidate, 0) + 1
+        state_hash = snapshot.state_hash(
+            counts, voter_digest, self.stats.digest_after(transactions, block.timestamp,
+                                                          self.last_block.timestamp))
+        return counts, voter_digest, state_hash, transactions, uids
+
+    def index_block(self, block):
+        """
+        Update the running indexes with a block that is being appended to
+        the chain, so queries don't have to rescan it. The new state is
+        worked out and checked against the one the block commits to
+        before any index is touched, so a block that can't be indexed or
+        whose state hash is wrong raises ValueError and leaves them as
+        they were.
+        """
+        counts, voter_digest, state_hash, transactions, uids = self.next_state(block)
+        if state_hash != block.state_hash:
+            raise ValueError("Block {} doesn't commit to the state of the "
+                             "chain".format(block.index))
+
+        if self.registry is not None and uids:
+            self.registry.register_many(uids)
+        for position, tx_hash in enumerate(block.leaf_hashes):
+            self.leaf_index[tx_hash] = (block.index, position)
+            self.mempool.discard(tx_hash)
+        for transaction in transactions:
+            self.stats.count(transaction, block.timestamp, self.last_block.timestamp)
+        self.tally_history.append(counts)
+        self.voter_digests.append(voter_digest)
+
     def add_block(self, block, proof):
         """
         A function that adds the block to the chain after verification.
@@ -76,98 +472,566 @@ class Blockchain:
         * Checking if the proof is valid.
         * The previous_hash referred in the block and the hash of latest block
           in the chain match.
+        * The block has the difficulty required at its height.
+        * Its timestamp follows the previous block's and is not too far
+          in the future.
+        * Its transactions can be indexed and it commits to the state of
+          the chain they lead to.
+        The block is indexed before it is appended, so a block that fails
+        leaves the chain, its indexes and the chain store untouched.
         """
         previous_hash = self.last_block.hash
 
         if previous_hash != block.previous_hash:
             return False
 
+        if block.index != len(self.chain) or \
+                block.difficulty != self.required_difficulty(self.chain, block.index) or \
+                not self.is_valid_timestamp(self.chain, block):
+            return False
+
         if not Blockchain.is_valid_proof(block, proof):
             return False
 
         block.hash = proof
+        try:
+            self.index_block(block)
+        except ValueError:
+            return False
         self.chain.append(block)
+        if self.store is not None:
+            self.store.append(block, self.tally, self.voter_digests[-1], self.stats)
         return True
 
+    def add_verified_block(self, block, proof):
+        """
+        Append a block that was verified before, e.g. when it was first
+        written to the chain store, only checking that it links up.
+        """
+        if self.last_block.hash != block.previous_hash:
+            return False
+
+        block.hash = proof
+        try:
+            self.index_block(block)
+        except ValueError:
+            return False
+        self.chain.append(block)
+        return True
+
+    def add_stored_block(self, block, proof, tally, voter_digest):
+        """
+        Append a block that was verified and indexed before it was written
+        to the chain store, only checking that it links up. Its tally and
+        voter digest are taken from the store and its voters were added
+        to the registry back then, so its transactions are not parsed
+        again. The vote stats are left as they are, the caller restores
+        them from the checkpoint.
+        """
+        if self.last_block.hash != block.previous_hash:
+            return False
+
+        block.hash = proof
+        self.chain.append(block)
+        for position, tx_hash in enumerate(block.leaf_hashes):
+            self.leaf_index[tx_hash] = (block.index, position)
+        self.tally_history.append(tally)
+        self.voter_digests.append(voter_digest)
+        return True
+
+    @classmethod
+    def load(cls, store, registry=None):
+        """
+        Rebuild the blockchain from a chain store, starting from its
+        snapshot if it has one. Blocks up to the stored checkpoint are
+        trusted: they are appended with the vote hashes, tally and voter
+        digest stored with them, without parsing or hashing their
+        transactions, and the vote stats are restored as of the
+        checkpoint. The ones after it are verified and indexed again, and
+        their voters are added to `registry`. A stored block that fails
+        is dropped together with its successors, and so is a snapshot,
+        and they are synced again from peers. If the trusted blocks don't
+        lead to the checkpoint, every block is verified again.
+        """
+        base_snapshot = store.snapshot
+        blockchain = None
+        if base_snapshot is not None:
+            try:
+                blockchain = cls.from_snapshot(*base_snapshot)
+            except (ChainError, ValueError, KeyError, TypeError):
+                store.set_snapshot(None)
+        if blockchain is None:
+            blockchain = cls()
+            blockchain.create_genesis_block()
+        blockchain.registry = registry
+        checkpoint_height, checkpoint_hash, checkpoint_stats = store.checkpoint
+        # whether the vote stats are those of the chain loaded so far
+        restored = checkpoint_height <= blockchain.pruned_height
+
+        for header, encoded_transactions, leaf_hashes, tally, voter_digest in \
+                store.iter_blocks():
+            index = header['index']
+            if index <= blockchain.pruned_height:
+                continue
+            if index <= checkpoint_height:
+                block = Block.from_encoded(index, encoded_transactions, leaf_hashes,
+                                           header['timestamp'], header['previous_hash'],
+                                           header['nonce'], header['difficulty'],
+                                           header['state_hash'])
+                if not blockchain.add_stored_block(block, header['hash'], tally,
+                                                   voter_digest) or \
+                        index == checkpoint_height and header['hash'] != checkpoint_hash:
+                    break
+                if index == checkpoint_height:
+                    blockchain.stats = VoteStats.from_rows(checkpoint_stats)
+                    restored = True
+            elif not blockchain.add_block(Block.from_wire(header, encoded_transactions),
+                                          header['hash']):
+                store.truncate(blockchain.last_block.index + 1)
+                break
+
+        if not restored:
+            store.set_checkpoint(None)
+            return cls.load(store, registry)
+        blockchain.store = store
+        store.set_checkpoint(blockchain.last_block, blockchain.stats)
+        return blockchain
+
+    @classmethod
+    def from_snapshot(cls, base_snapshot, headers):
+        """
+        Build a pruned chain from a snapshot and the headers of the blocks
+        up to it, after checking that:
+        * the headers link up to the snapshot's block from our genesis
+          block, with the required difficulty
+        * the hash of every block, computed again from its header and
+          the Merkle root of its vote hashes, matches its proof of work
+        * the tally, voter digest and vote stats of the snapshot are the
+          state its block commits to, and its voters add up to the digest
+        The transactions of the pruned blocks are not available, so the
+        state itself can't be replayed: the snapshot is as trustworthy as
+        the proof of work of the headers.
+        """
+        if not snapshot.is_sealed(base_snapshot):
+            raise ChainError("The snapshot is tampered!!")
+        height = base_snapshot['height']
+        leaves = base_snapshot['leaves']
+        if len(headers) != height + 1 or len(leaves) != height:
+            raise ChainError("The snapshot doesn't match the chain headers!!")
+
+        blockchain = cls()
+        blockchain.create_genesis_block()
+        if headers[0]['hash'] != blockchain.last_block.hash:
+            raise ChainError("The snapshot doesn't match the chain headers at block 0!!")
+        for header, leaf_hashes in zip(headers[1:], leaves):
+            block = Block.from_header(header, leaf_hashes)
+            if block.index != blockchain.last_block.index + 1 or \
+                    block.previous_hash != blockchain.last_block.hash or \
+                    block.difficulty != cls.required_difficulty(blockchain.chain,
+                                                                block.index) or \
+                    not cls.is_valid_timestamp(blockchain.chain, block) or \
+                    block.merkle_tree() != header['merkle_root'] or \
+                    not cls.is_valid_proof(block, block.hash):
+                raise ChainError("The snapshot doesn't match the chain headers "
+                                "at block {}!!".format(block.index))
+            blockchain.chain.append(block)
+            for position, tx_hash in enumerate(leaf_hashes):
+                blockchain.leaf_index[tx_hash] = (block.index, position)
+            blockchain.tally_history.append(None)
+            blockchain.voter_digests.append(None)
+
+        stats = VoteStats.from_rows(base_snapshot['stats'])
+        voter_digest = int(base_snapshot['voter_digest'], 16)
+        if blockchain.last_block.hash != base_snapshot['hash'] or \
+                blockchain.last_block.state_hash != snapshot.state_hash(
+                    base_snapshot['tally'], voter_digest, stats.digest) or \
+                snapshot.digest_voters(base_snapshot['voters']) != voter_digest:
+            raise ChainError("The snapshot doesn't match the chain headers "
+                            "at block {}!!".format(height))
+        blockchain.stats = stats
+        blockchain.tally_history[-1] = base_snapshot['tally']
+        blockchain.voter_digests[-1] = voter_digest
+        blockchain.pruned_height = height
+        blockchain.base_snapshot = (base_snapshot, headers)
+        return blockchain
+
+    def snapshot_height(self):
+        """
+        Return the height of the latest snapshot of the chain, or None if
+        it is not long enough to have one.
+        """
+        tip = self.last_block.index
+        height = (tip - self.snapshot_confirmations) // self.snapshot_interval * \
+            self.snapshot_interval
+        height = max(height, self.pruned_height)
+        return height if height > 0 else None
+
+    def snapshot(self):
+        """
+        Return the latest snapshot of the chain, see `snapshot`. It is
+        built on first request and reused until the next one is due.
+        """
+        height = self.snapshot_height()
+        if height is None:
+            return None
+        if self._snapshot is None or self._snapshot['height'] != height:
+            # the voters of the pruned blocks come from our own snapshot
+            voters = self.base_snapshot[0]['voters'] if self.base_snapshot else []
+            voters = voters + [transaction['uid']
+                               for block in self.chain[self.pruned_height + 1:height + 1]
+                               for transaction in block.transactions if 'uid' in transaction]
+            self._snapshot = snapshot.seal(
+                height, self.chain[height].hash, self.tally_history[height],
+                self.voter_digests[height], self.stats_at(height).rows(), voters,
+                [list(block.leaf_hashes) for block in self.chain[1:height + 1]])
+        return self._snapshot
+
+    def stats_at(self, height):
+        """
+        Return the vote stats as they were once the block at `height` was
+        appended, by taking back the votes of the blocks after it.
+        """
+        stats = self.stats.copy()
+        for block in self.chain[height + 1:]:
+            for transaction in block.transactions:
+                stats.count(transaction, block.timestamp, self.chain[block.index - 1].timestamp,
+                            votes=-1)
+        return stats
+
+    def fork(self, height):
+        """
+        Return a new blockchain sharing this chain's blocks up to
+        `height`, to append a competing branch to.
+        """
+        forked = Blockchain()
+        forked.chain = self.chain[:height + 1]
+        forked.tally_history = self.tally_history[:height + 1]
+        forked.voter_digests = self.voter_digests[:height + 1]
+        forked.stats = self.stats_at(height)
+        forked.leaf_index = {tx_hash: location
+                             for tx_hash, location in self.leaf_index.items()
+                             if location[0] <= height}
+        forked.pruned_height = self.pruned_height
+        forked.base_snapshot = self.base_snapshot
+        return forked
+
     @staticmethod
     def proof_of_work(block):
         """
         Function that tries different values of nonce to get a hash
-        that satisfies our difficulty criteria.
+        that satisfies the difficulty recorded in the block.
         """
-        block.nonce = 0
-
-        computed_hash = block.compute_hash()
-        while not computed_hash.startswith('0' * Blockchain.difficulty):
-            block.nonce += 1
-            computed_hash = block.compute_hash()
-
+        block.nonce, computed_hash = Blockchain.pow_engine.search(
+            block.hashing_prefix(), block.difficulty)
+        POW_SECONDS.observe(Blockchain.pow_engine.last_duration)
         return computed_hash
 
+    @property
+    def unconfirmed_transactions(self):
+        return self.mempool.transactions
+
     def add_new_transaction(self, transaction):
-        self.unconfirmed_transactions.append(transaction)
+        """
+        Admit a transaction to the mempool. Returns False if it is already
+        pending or the mempool is full.
+        """
+        encoded = encode_transaction(transaction)
+        return self.mempool.add(sha256(encoded).hexdigest(), transaction, encoded)
+
+    def locate_vote(self, leaf_hash):
+        """
+        Return the (block index, leaf position) of a confirmed vote hash,
+        or None if it is not on the chain.
+        """
+        return self.leaf_index.get(leaf_hash)
+
+    def is_pending(self, leaf_hash):
+        return leaf_hash in self.mempool
 
     @classmethod
     def is_valid_proof(cls, block, block_hash):
         """
         Check if block_hash is valid hash of block and satisfies
-        the difficulty criteria.
+        the difficulty recorded in the block.
         """
-        return (block_hash.startswith('0' * Blockchain.difficulty) and
+        return (block_hash.startswith('0' * block.difficulty) and
                 block_hash == block.compute_hash())
 
     @classmethod
     def check_chain_validity(cls, chain):
-        result = True
-        previous_hash = "0"
-
-        for block in chain:
-            block_hash = block.hash
-            # remove the hash field to recompute the hash again
-            # using `compute_hash` method.
-            delattr(block, "hash")
-
-            if not cls.is_valid_proof(block, block_hash) or \
-                    previous_hash != block.previous_hash:
-                result = False
-                break
-
-            block.hash, previous_hash = block_hash, block_hash
+        return cls.find_invalid_block(chain) is None
 
-        return result
+    @classmethod
+    def find_invalid_block(cls, chain):
+        """
+        Return the index of the first block whose proof is wrong, which
+        doesn't link to its predecessor or doesn't have the required
+        difficulty or a valid timestamp, or None if the chain is valid. The
+        leaf hashes, Merkle roots and block hashes are computed in parallel
+        by the PoW engine from the encoded transactions, kept in the
+        blocks, and the rest is checked afterwards in a cheap sequential
+        pass.
+        """
+        if not chain or chain[0].hash != cls.genesis_block().hash:
+            return 0
+
+        hashes = cls.pow_engine.hash_blocks([(block.record_header(),
+                                              block.encoded_transactions)
+                                             for block in chain[1:]])
+        previous_hash = chain[0].hash
+        try:
+            for index, (block, (leaf_hashes, merkle_root, computed_hash)) in \
+                    enumerate(zip(chain[1:], hashes), 1):
+                block.set_hashes(leaf_hashes, merkle_root)
+                if block.hash != computed_hash or \
+                        block.index != index or \
+                        block.difficulty != cls.required_difficulty(chain, index) or \
+                        not cls.is_valid_timestamp(chain, block) or \
+                        not computed_hash.startswith('0' * block.difficulty) or \
+                        previous_hash != block.previous_hash:
+                    return block.index
+                previous_hash = block.hash
+        finally:
+            hashes.close()
+
+        return None
 
     def mine(self):
         """
         This function serves as an interface to add the pending
         transactions to the blockchain by adding them to the block
-        and figuring out Proof Of Work.
+        and figuring out Proof Of Work. At most `max_block_transactions`
+        or `max_block_bytes` worth of transactions go into one block, the
+        rest stay in the mempool for the next one.
         """
-        if not self.unconfirmed_transactions:
-            return False
+        with self.mining_lock:
+            new_block = self.seal_block()
+            if new_block is None:
+                return False
+            # the sealed transactions leave the mempool as the block is indexed
+            return self.add_block(new_block, new_block.hash)
+
+    def seal_block(self):
+        """
+        Build the next block from the pending transactions and find its
+        proof of work, without appending it. The transactions are only
+        peeked, they stay in the mempool until the block is appended, so
+        if the chain moves on in the meantime they are simply mined
+        again. Returns None if there is nothing to mine.
+        """
+        batch = self.mempool.peek(self.max_block_transactions, self.max_block_bytes)
+        if not batch:
+            return None
 
         last_block = self.last_block
-        new_block = Block(index=last_block.index + 1,
-                          transactions=self.unconfirmed_transactions,
-                          timestamp=time.time(),
-                          previous_hash=last_block.hash)
-
-        proof = self.proof_of_work(new_block)
-        self.add_block(new_block, proof)
-
-        self.unconfirmed_transactions = []
-
-        return True
+        new_block = Block.from_encoded(index=last_block.index + 1,
+                                       encoded_transactions=[encoded for _, encoded in batch],
+                                       leaf_hashes=[tx_hash for tx_hash, _ in batch],
+                                       # timestamps must increase even
+                                       # if our clock is behind
+                                       timestamp=max(time.time(),
+                                                     last_block.timestamp + 0.001),
+                                       previous_hash=last_block.hash,
+                                       difficulty=self.required_difficulty(
+                                           self.chain, last_block.index + 1))
+        new_block.state_hash = self.next_state(new_block)[2]
+        new_block.hash = self.proof_of_work(new_block)
+        return new_block
 
 
 app = Flask(__name__)
 
-# the node's copy of blockchain
-blockchain = Blockchain()
-blockchain.create_genesis_block()
+# the node's copy of blockchain, restored from its on-disk chain store.
+# Give each node on the same machine its own file, e.g.
+# CHAIN_STORE=chain-8001.db flask run --port 8001
+CHAIN_STORE = os.environ.get('CHAIN_STORE', 'chain.db')
+
+# proof of work settings, shared by every node of the network: the
+# difficulty of the first blocks, the block interval it is retargeted
+# towards (0 to keep it fixed) and how many blocks a retarget spans
+Blockchain.difficulty = int(os.environ.get('DIFFICULTY', Blockchain.difficulty))
+Blockchain.target_block_seconds = float(os.environ.get('TARGET_BLOCK_SECONDS',
+                                                       Blockchain.target_block_seconds))
+Blockchain.retarget_interval = int(os.environ.get('RETARGET_INTERVAL',
+                                                  Blockchain.retarget_interval))
+
+# the uids that have already voted, pending or confirmed on any of the
+# node's chains
+voter_registry = VoterRegistry('test.db')
+
+chain_store = ChainStore(CHAIN_STORE)
+blockchain = Blockchain.load(chain_store, voter_registry)
+# serializes every change of the main chain: mining, blocks received
+# from peers, syncing and replacing it, so none of them works on a
+# chain that is being replaced meanwhile
+chain_lock = threading.RLock()
+
+# Sharded mode: SHARDS=<id>,<id>,... gives every shard, e.g. a polling
+# venue, its own chain, mempool, miner and chain store file next to
+# CHAIN_STORE (chain-<id>.db). Votes are routed to a shard by their
+# venue_id and sealed in parallel, see `shard_for`. Shards are local to
+# the node, only the main chain is synced with peers.
+SHARD_IDS = [shard_id.strip() for shard_id in os.environ.get('SHARDS', '').split(',')
+             if shard_id.strip()]
+shards = {}
+for shard_id in SHARD_IDS:
+    store_root, store_extension = os.path.splitext(CHAIN_STORE)
+    shards[shard_id] = Blockchain.load(
+        ChainStore('{}-{}{}'.format(store_root, shard_id, store_extension)),
+        voter_registry)
+shard_executor = ThreadPoolExecutor(max_workers=max(len(SHARD_IDS), 1))
 
 # the address to other participating members of the network
 peers = set()
 
+# pooled, concurrent HTTP client used to reach the peers
+peer_client = PeerClient()
+
+# Accept header asking peers for blocks in the binary format, falling
+# back to JSON with peers that predate it
+WIRE_ACCEPT = '{}, application/json;q=0.5'.format(wire.MEDIA_TYPE)
+# peers that rejected a binary block, announcements to them use JSON
+json_only_peers = set()
+
+metrics.Gauge('mempool_depth', 'Number of unconfirmed transactions',
+              function=lambda: len(blockchain.mempool))
+metrics.Gauge('chain_height', 'Index of the last block of the chain',
+              function=lambda: blockchain.last_block.index)
+metrics.Gauge('pow_hash_rate', 'Hashes per second of the last proof of work search',
+              function=lambda: Blockchain.pow_engine.hash_rate)
+
+# sampling profiler, switched on and off through /profiler
+profiler = metrics.SamplingProfiler()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_SECONDS.observe(time.perf_counter() - g.request_started,
+                            route=route, method=request.method)
+    return response
+
+
+def cached_until_next_block(*depends_on):
+    """
+    Decorator for endpoints whose response only changes when a block is
+    added to the chain. The response gets an ETag derived from the tip
+    hash, the request and the values returned by `depends_on`, and a
+    request whose If-None-Match holds it is answered with 304 without
+    building the response again.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = sha256(json.dumps(
+                [chain.last_block.hash for _, chain in chains()] + [request.full_path,
+                 request.headers.get('Accept'), request.headers.get('Accept-Encoding')] +
+                [function() for function in depends_on]).encode()).hexdigest()
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = app.make_response(view(*args, **kwargs))
+            response.set_etag(etag, weak=True)
+            # clients keep the response but check it again every time
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+def chains():
+    """
+    Return the (shard id, blockchain) of the main chain, whose shard id
+    is None, followed by those of the shards.
+    """
+    return [(None, blockchain)] + [(shard_id, shards[shard_id]) for shard_id in SHARD_IDS]
+
+
+def shard_for(transaction):
+    """
+    Return the id of the shard a vote is sealed in: the shard named
+    after its venue, or else one picked by hashing the venue, so every
+    node routes a venue to the same shard.
+    """
+    venue = str(transaction.get('venue_id'))
+    if venue in shards:
+        return venue
+    return SHARD_IDS[zlib.crc32(venue.encode()) % len(SHARD_IDS)]
+
+
+def chain_for(transaction):
+    return shards[shard_for(transaction)] if shards else blockchain
+
+
+def has_string_fields(data, fields):
+    """
+    Check that submitted data is an object holding a non-empty string in
+    each of the given fields.
+    """
+    return isinstance(data, dict) and all(
+        isinstance(data.get(field), str) and data[field] for field in fields)
+
+
+def requested_chain():
+    """
+    Return the chain of the shard named by the `shard` query parameter,
+    the main chain if there is none, or None if there is no such shard.
+    """
+    shard_id = request.args.get('shard')
+    if shard_id is None:
+        return blockchain
+    return shards.get(shard_id)
+
+
+def merge_tallies(tallies):
+    merged = {}
+    for tally in tallies:
+        for candidate, votes in tally.items():
+            merged[candidate] = merged.get(candidate, 0) + votes
+    return merged
+
+
+def chain_of_vote(leaf_hash):
+    """
+    Return the (shard id, blockchain) holding a vote, confirmed or
+    pending, or the main chain if none does.
+    """
+    for shard_id, chain in chains():
+        if chain.locate_vote(leaf_hash) is not None or chain.is_pending(leaf_hash):
+            return shard_id, chain
+    return None, blockchain
+
+
+# endpoint to expose the node's metrics in Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+# endpoint to switch the sampling profiler on or off at runtime, e.g.
+# {"enabled": true, "interval": 0.005}, and read its hottest locations
+@app.route('/profiler', methods=['GET', 'POST'])
+def sampling_profiler():
+    if request.method == 'POST':
+        settings = request.get_json() or {}
+        if not isinstance(settings, dict):
+            return "Invalid profiler settings", 400
+        interval = settings.get("interval", 0.01)
+        # a zero interval would spin the sampling thread
+        if not isinstance(interval, (int, float)) or isinstance(interval, bool) or \
+                not 0 < interval < float('inf'):
+            return "Invalid profiler interval", 400
+        if settings.get("enabled"):
+            profiler.start(float(interval))
+        else:
+            profiler.stop()
+    return json.dumps(profiler.top(request.args.get('limit', 20, type=int)))
+
 # endpoint to login. This will be used by
 # our application to add new data (posts) to the blockchain
 @app.route('/login', methods=['POST'])
@@ -175,11 +1039,10 @@ def login():
     tx_data = request.get_json()
     required_fields = ["uid"]
 
-    for field in required_fields:
-        if not tx_data.get(field):
-            return "Invalid transaction data", 404
+    if not has_string_fields(tx_data, required_fields):
+        return "Invalid transaction data", 404
 
-    if is_user_exist(tx_data["uid"]):
+    if voter_registry.has_voted(tx_data["uid"]):
         return "Voter has been voted", 400
 
     return "Voter has not been voted", 200
@@ -192,32 +1055,183 @@ def new_transaction():
     tx_data = request.get_json()
     required_fields = ["name", "uid", "voted_candidate"]
 
-    for field in required_fields:
-        if not tx_data.get(field):
-            return "Invalid transaction data", 404
-    
-    if is_user_exist(tx_data["uid"]):
-        return "This voter has been voted", 400
+    if not has_string_fields(tx_data, required_fields):
+        return "Invalid transaction data", 404
+
+    tx_data_hash = compute_transaction_hash(tx_data)
+
+    # hold the mempool while registering, so a registered voter's
+    # ballot can't be turned away because the pool filled up meanwhile.
+    # The registry is shared by all shards, a voter only votes once.
+    chain = chain_for(tx_data)
+    mempool = chain.mempool
+    with mempool.lock:
+        if mempool.is_full():
+            return "The node is busy, please submit your vote again later", 503
+        if not voter_registry.register(tx_data["uid"]):
+            return "This voter has been voted", 400
+        chain.add_new_transaction(tx_data)
+    return "<p> Vote has been requested, please note the following data for verifaction purpose. </p> <p> vote hash: <b>" + tx_data_hash + "</b>.</p><p>You can only verify your data after your vote has been confirmed.</p>", 201
 
-    tx_data_str = json.dumps(tx_data)
-    tx_data_hash = sha256(tx_data_str.encode()).hexdigest()
 
-    blockchain.add_new_transaction(tx_data)
-    register_user(tx_data['uid'])
-    return "<p> Vote has been requested, please note the following data for verifaction purpose. </p> <p> vote hash: <b>" + tx_data_hash + "</b>.</p><p>You can only verify your data after your vote has been confirmed.</p>", 201
+# endpoint to submit a batch of transactions at once, as a JSON array
+# or as NDJSON (one ballot per line). Returns one receipt per ballot, in
+# order, with either the vote hash or the reason it was rejected.
+@app.route('/new_transactions', methods=['POST'])
+def new_transactions():
+    required_fields = ["name", "uid", "voted_candidate"]
+
+    try:
+        if request.mimetype == 'application/x-ndjson':
+            ballots = [json.loads(line) for line in request.stream if line.strip()]
+        else:
+            ballots = json.loads(request.get_data())
+    except ValueError:
+        return "Invalid transaction data", 400
+    if not isinstance(ballots, list):
+        return "Invalid transaction data", 400
+
+    receipts = [None] * len(ballots)
+    accepted = []
+    batch_uids = set()
+    for position, ballot in enumerate(ballots):
+        if not has_string_fields(ballot, required_fields):
+            receipts[position] = {"error": "Invalid transaction data"}
+        elif ballot["uid"] in batch_uids:
+            receipts[position] = {"error": "This voter appears twice in the batch"}
+        else:
+            batch_uids.add(ballot["uid"])
+            accepted.append((position, ballot))
+
+    # in sharded mode the ballots are admitted shard by shard
+    by_chain = {}
+    for position, ballot in accepted:
+        by_chain.setdefault(chain_for(ballot), []).append((position, ballot))
+
+    for chain, pending in by_chain.items():
+        mempool = chain.mempool
+        with mempool.lock:
+            # only register as many voters as the mempool has room for,
+            # one SQLite transaction at a time. Ballots of voters who
+            # have voted before don't take any room, so the next ones
+            # are tried in their place.
+            while pending:
+                room = max(mempool.max_size - len(mempool), 0)
+                if not room:
+                    break
+                accepted, pending = pending[:room], pending[room:]
+                registered = voter_registry.register_many(
+                    [ballot["uid"] for _, ballot in accepted])
+                for position, ballot in accepted:
+                    if ballot["uid"] not in registered:
+                        receipts[position] = {"error": "This voter has been voted"}
+                        continue
+                    chain.add_new_transaction(ballot)
+                    receipts[position] = {"vote_hash": compute_transaction_hash(ballot)}
+            for position, _ in pending:
+                receipts[position] = {"error": "The node is busy, please submit this vote again later"}
+
+    return json.dumps(receipts), 200
 
 
 # endpoint to return the node's copy of the chain.
 # Our application will be using this endpoint to query
 # all the posts to display.
+# Optional query parameters:
+# * `from`, `to`: inclusive range of block heights to return
+# * `limit`: maximum number of blocks to return
+# * `headers`: return block headers only, without the transactions
+# * `format=ndjson`: stream one block per line instead of one document
+# * `shard`: return the chain of this shard instead of the main chain
 @app.route('/chain', methods=['GET'])
+@cached_until_next_block(lambda: sorted(peers))
 def get_chain():
-    chain_data = []
-    for block in blockchain.chain:
-        chain_data.append(block.__dict__)
-    return json.dumps({"length": len(chain_data),
-                       "chain": chain_data,
-                       "peers": list(peers)})
+    selected = requested_chain()
+    if selected is None:
+        return "Unknown shard", 404
+
+    start = request.args.get('from', 0, type=int)
+    end = request.args.get('to', type=int)
+    limit = request.args.get('limit', type=int)
+    if start < 0 or (end is not None and end < start) or \
+            (limit is not None and limit < 0):
+        return "Invalid block range", 400
+    stop = len(selected.chain) if end is None else end + 1
+    if limit is not None:
+        stop = min(stop, start + limit)
+
+    if selected.pruned_height and not request.args.get('headers') and \
+            start <= selected.pruned_height:
+        return "Blocks up to height {} are pruned on this node, use " \
+               "/snapshot".format(selected.pruned_height), 404
+
+    blocks = selected.chain[start:stop]
+    # full blocks reuse their encoded transactions instead of
+    # serializing them again
+    if request.args.get('headers'):
+        def serialize(block):
+            return json.dumps(block.header()).encode()
+    else:
+        serialize = Block.to_json
+
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            for block in blocks:
+                yield serialize(block) + b"\n"
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    # nodes that understand it get full blocks in the binary format
+    if not request.args.get('headers') and accepts_wire_format():
+        body = wire.encode_chain({"length": len(selected.chain),
+                                  "peers": list(peers)},
+                                 [block.to_wire() for block in blocks])
+        return compressed_response(body, wire.MEDIA_TYPE)
+
+    body = b'{"length": %d, "chain": [%b], "peers": %b}' % (
+        len(selected.chain), b', '.join(serialize(block) for block in blocks),
+        json.dumps(list(peers)).encode())
+    return compressed_response(body, 'application/json')
+
+
+def accepts_wire_format():
+    return request.accept_mimetypes.best_match(
+        ['application/json', wire.MEDIA_TYPE]) == wire.MEDIA_TYPE
+
+
+def compressed_response(body, mimetype):
+    """
+    Return `body` as a response, gzip compressed if the client accepts it
+    and the body is big enough to be worth it.
+    """
+    response = Response(body, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    if len(body) >= wire.COMPRESS_MIN_BYTES and 'gzip' in request.accept_encodings:
+        response.set_data(wire.compress(body))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+# endpoint to return the height and hash of the last block, so
+# peers can compare chains before downloading anything
+@app.route('/tip', methods=['GET'])
+@cached_until_next_block()
+def get_tip():
+    selected = requested_chain()
+    if selected is None:
+        return "Unknown shard", 404
+    return json.dumps({"height": selected.last_block.index,
+                       "hash": selected.last_block.hash})
+
+
+# endpoint to return the latest checkpoint snapshot of the chain, so
+# joining nodes only need the blocks after it
+@app.route('/snapshot', methods=['GET'])
+@cached_until_next_block()
+def get_snapshot():
+    latest = blockchain.snapshot()
+    if latest is None:
+        return "The chain is too short for a snapshot", 404
+    return compressed_response(json.dumps(latest).encode(), 'application/json')
 
 
 # endpoint to request the node to mine the unconfirmed
@@ -225,17 +1239,39 @@ def get_chain():
 # a command to mine from our application itself.
 @app.route('/mine', methods=['GET'])
 def mine_unconfirmed_transactions():
-    result = blockchain.mine()
-    if not result:
+    result = mine_and_announce()
+    mined_shards = mine_shards()
+    if not result and not mined_shards:
         return "No transactions to mine"
-    else:
-        # Making sure we have the longest chain before announcing to the network
-        chain_length = len(blockchain.chain)
-        consensus()
-        if chain_length == len(blockchain.chain):
-            # announce the recently mined block to the network
-            announce_new_block(blockchain.last_block)
+    elif not mined_shards:
         return "<p> A new block has been mined. Please record this for verification purpose. </p> <p> block-index: {} </p> <p> merkle-root: {} </p>".format(blockchain.last_block.index, blockchain.last_block.merkle_tree()), 200
+    else:
+        mined = [(None, blockchain)] if result else []
+        mined += [(shard_id, shards[shard_id]) for shard_id in mined_shards]
+        return "<p> New blocks have been mined. Please record this for verification purpose. </p>" + \
+            "".join("<p> shard: {} block-index: {} merkle-root: {} </p>".format(
+                shard_id or "main", chain.last_block.index, chain.last_block.merkle_tree())
+                for shard_id, chain in mined), 200
+
+
+# endpoint to query the hash rate and duration of the last
+# proof of work search
+@app.route('/mining_stats', methods=['GET'])
+def get_mining_stats():
+    stats = Blockchain.pow_engine.stats()
+    stats["difficulty"] = blockchain.last_block.difficulty
+    stats["next_difficulty"] = Blockchain.required_difficulty(
+        blockchain.chain, len(blockchain.chain))
+    stats["target_block_seconds"] = Blockchain.target_block_seconds
+    return json.dumps(stats)
+
+
+# endpoint to list the peers of this node along with their health:
+# consecutive failures, average latency and whether they are currently
+# backed off
+@app.route('/peers', methods=['GET'])
+def get_peers():
+    return json.dumps(peer_client.health(sorted(peers)))
 
 
 # endpoint to add new peers to the network.
@@ -265,57 +1301,180 @@ def register_with_existing_node():
         return "Invalid data", 400
 
     data = {"node_address": request.host_url}
-    headers = {'Content-Type': "application/json"}
+    headers = {'Content-Type': "application/json", 'Accept': WIRE_ACCEPT}
 
-    # Make a request to register with remote node and obtain information
-    response = requests.post(node_address + "/register_node",
-                             data=json.dumps(data), headers=headers)
+    # Make a request to register with remote node and obtain information,
+    # starting from its snapshot if it has one
+    try:
+        base_chain = bootstrap_from_snapshot(node_address)
+    except (ChainError, ValueError, KeyError, TypeError):
+        # the snapshot doesn't check out, sync every block instead
+        base_chain = None
+    except requests.RequestException:
+        return "Unable to connect to the node", 503
+    start = base_chain.last_block.index + 1 if base_chain else 0
+    try:
+        response = peer_client.post(node_address, "register_node",
+                                    params={'from': start},
+                                    data=json.dumps(data), headers=headers)
+    except requests.RequestException:
+        return "Unable to connect to the node", 503
 
     if response.status_code == 200:
-        global blockchain
         global peers
         # update chain and the peers
-        chain_dump = response.json()['chain']
-        blockchain = create_chain_from_dump(chain_dump)
-        peers.update(response.json()['peers'])
+        try:
+            metadata, blocks = read_chain_response(response)
+            new_peers = metadata['peers']
+            if not isinstance(new_peers, list) or \
+                    not all(isinstance(peer, str) for peer in new_peers):
+                raise ValueError("Invalid peers")
+            if base_chain is None:
+                new_chain = create_chain_from_blocks(blocks)
+            else:
+                for block, proof in blocks:
+                    if not base_chain.add_block(block, proof):
+                        raise ChainError("The chain dump is tampered at block {}!!".format(
+                            block.index))
+                new_chain = base_chain
+        except (ChainError, ValueError, KeyError, TypeError):
+            return "The node sent an invalid chain", 502
+        replace_chain(new_chain)
+        peers.update(new_peers)
         return "Registration successful", 200
     else:
         # if something goes wrong, pass it on to the API response
         return response.content, response.status_code
 
 
-def create_chain_from_dump(chain_dump):
+def bootstrap_from_snapshot(node):
+    """
+    Build a pruned chain from the node's latest snapshot, checked
+    against its block headers. Returns None if the node has no snapshot.
+    """
+    response = peer_client.get(node, 'snapshot')
+    if response.status_code != 200:
+        return None
+    latest = response.json()
+    response = peer_client.get(node, 'chain', params={'to': latest['height'],
+                                                      'headers': 1})
+    return Blockchain.from_snapshot(latest, response.json()['chain'])
+
+
+def read_chain_response(response):
+    """
+    Return the metadata and the list of (block, proof) of a /chain or
+    /register_node response, whether the peer answered in the binary
+    format or in JSON.
+    """
+    if response.headers.get('Content-Type', '').startswith(wire.MEDIA_TYPE):
+        metadata, records = wire.decode_chain(response.content)
+        for header, _ in records:
+            check_block_fields(header)
+        return metadata, [(Block.from_wire(header, encoded_transactions), header['hash'])
+                          for header, encoded_transactions in records]
+    data = response.json()
+    for block_data in data['chain']:
+        check_block_fields(block_data)
+    return ({"length": data['length'], "peers": data.get('peers', [])},
+            [(Block.from_dict(block_data), block_data['hash'])
+             for block_data in data['chain']])
+
+
+def create_chain_from_blocks(blocks):
+    chain = []
+    for block, proof in blocks:
+        block.hash = proof
+        chain.append(block)
+
+    invalid_index = Blockchain.find_invalid_block(chain)
+    if invalid_index is not None:
+        raise ChainError("The chain dump is tampered at block {}!!".format(invalid_index))
+
     generated_blockchain = Blockchain()
     generated_blockchain.create_genesis_block()
-    for idx, block_data in enumerate(chain_dump):
-        if idx == 0:
-            continue  # skip genesis block
-        block = Block(block_data["index"],
-                      block_data["transactions"],
-                      block_data["timestamp"],
-                      block_data["previous_hash"],
-                      block_data["nonce"])
-        proof = block_data['hash']
-        added = generated_blockchain.add_block(block, proof)
-        if not added:
-            raise Exception("The chain dump is tampered!!")
+    for block in chain[1:]:
+        if not generated_blockchain.add_verified_block(block, block.hash):
+            raise ChainError("The chain dump is tampered at block {}!!".format(block.index))
     return generated_blockchain
 
 
+def replace_chain(new_blockchain):
+    """
+    Swap the node's chain for a validated replacement and rewrite the
+    chain store from the height where the two chains fork. The votes of
+    the blocks we drop that the new chain doesn't hold go back to the
+    mempool to be mined again.
+    """
+    global blockchain
+
+    with chain_lock:
+        fork_height = min(len(blockchain.chain), len(new_blockchain.chain))
+        while fork_height > 0 and \
+                blockchain.chain[fork_height - 1].hash != new_blockchain.chain[fork_height - 1].hash:
+            fork_height -= 1
+
+        if new_blockchain.base_snapshot is not blockchain.base_snapshot:
+            chain_store.set_snapshot(new_blockchain.base_snapshot)
+            if new_blockchain.base_snapshot is not None:
+                voter_registry.register_many(
+                    [uid for uid in new_blockchain.base_snapshot[0]['voters']
+                     if isinstance(uid, str)])
+        chain_store.truncate(fork_height)
+        # pruned blocks are kept in the snapshot, not as blocks
+        chain_store.extend([(block, new_blockchain.tally_history[block.index],
+                             new_blockchain.voter_digests[block.index])
+                            for block in new_blockchain.chain[
+                                max(fork_height, new_blockchain.pruned_height + 1):]],
+                           new_blockchain.stats)
+        chain_store.set_checkpoint(new_blockchain.last_block, new_blockchain.stats)
+        new_blockchain.store = chain_store
+        # keep the votes that are still pending on the new chain
+        for tx_hash in blockchain.mempool.hashes():
+            if tx_hash in new_blockchain.leaf_index:
+                blockchain.mempool.discard(tx_hash)
+        # the new blocks were indexed on a detached chain, register
+        # their voters now that they are ours
+        voter_registry.register_many(
+            [transaction['uid'] for block in new_blockchain.chain[fork_height:]
+             if not block.pruned for transaction in block.transactions
+             if isinstance(transaction.get('uid'), str)])
+        new_blockchain.registry = voter_registry
+        orphaned = [(tx_hash, json.loads(encoded), encoded)
+                    for block in blockchain.chain[fork_height:] if not block.pruned
+                    for tx_hash, encoded in zip(block.leaf_hashes, block.encoded_transactions)
+                    if tx_hash not in new_blockchain.leaf_index]
+        blockchain.mempool.restore(orphaned)
+        new_blockchain.mempool = blockchain.mempool
+        blockchain = new_blockchain
+
+
 # endpoint to add a block mined by someone else to
 # the node's chain. The block is first verified by the node
 # and then added to the chain.
 @app.route('/add_block', methods=['POST'])
 def verify_and_add_block():
-    block_data = request.get_json()
-    block = Block(block_data["index"],
-                  block_data["transactions"],
-                  block_data["timestamp"],
-                  block_data["previous_hash"],
-                  block_data["nonce"])
-
-    proof = block_data['hash']
-    added = blockchain.add_block(block, proof)
+    body = request.get_data()
+    try:
+        if request.headers.get('Content-Encoding') == 'gzip':
+            body = wire.decompress(body)
+        if request.mimetype == wire.MEDIA_TYPE:
+            header, encoded_transactions = wire.decode_block(body)
+            check_block_fields(header)
+            block = Block.from_wire(header, encoded_transactions)
+            proof = header['hash']
+        elif request.mimetype == 'application/json':
+            block_data = json.loads(body)
+            check_block_fields(block_data)
+            block = Block.from_dict(block_data)
+            proof = block_data['hash']
+        else:
+            return "Unsupported block encoding", 415
+    except (OSError, EOFError, zlib.error, ValueError, KeyError, TypeError):
+        return "Malformed block", 400
+
+    with chain_lock:
+        added = blockchain.add_block(block, proof)
 
     if not added:
         return "The block was discarded by the node", 400
@@ -326,62 +1485,392 @@ def verify_and_add_block():
 # endpoint to query unconfirmed transactions
 @app.route('/pending_tx')
 def get_pending_tx():
-    return json.dumps(blockchain.unconfirmed_transactions)    
-
-# endpoint to query unconfirmed transactions
+    if request.args.get('shard') is not None:
+        selected = requested_chain()
+        if selected is None:
+            return "Unknown shard", 404
+        return json.dumps(selected.unconfirmed_transactions)
+    return json.dumps([transaction for _, chain in chains()
+                       for transaction in chain.unconfirmed_transactions])
+
+# endpoint to query the vote count per candidate, optionally
+# as of a given block height (`?height=<block index>`). In sharded
+# mode the counts of every shard are added up, unless one is picked
+# with `?shard=<id>`. Shards grow independently, so a height only
+# makes sense along with a shard.
 @app.route('/count_vote', methods=['GET'])
+@cached_until_next_block()
 def count_vote():
-    candidates = {
-        "Apple": 0,
-        "Banana": 0
-    }
-    for block in blockchain.chain:
-        for transaction in block.transactions:
-            voted_candidate = transaction.get('voted_candidate')
-            candidates[voted_candidate] += 1
+    selected = requested_chain()
+    if selected is None:
+        return "Unknown shard", 404
+    height = request.args.get('height', type=int)
+    if height is None:
+        if request.args.get('shard') is None:
+            return json.dumps(merge_tallies(chain.tally for _, chain in chains()))
+        return json.dumps(selected.tally)
+    if shards and request.args.get('shard') is None:
+        return "A block height can only be given along with a shard", 400
+
+    candidates = selected.tally_at(height)
+    if candidates is None:
+        return "Block height is out of range", 404
     return json.dumps(candidates)
 
+# endpoint to merge the shards into a global result: the tip and vote
+# count of the main chain and of every shard, their total, and a Merkle
+# root over the tip hashes, which commits to every block of every shard
+@app.route('/shards', methods=['GET'])
+@cached_until_next_block()
+def get_shards():
+    summary = [{"shard": shard_id,
+                "height": chain.last_block.index,
+                "hash": chain.last_block.hash,
+                "merkle_root": chain.last_block.merkle_tree(),
+                "tally": chain.tally} for shard_id, chain in chains()]
+    mt = MerkleTools(hash_type="sha256")
+    mt.add_leaf([shard["hash"] for shard in summary])
+    mt.make_tree()
+    return json.dumps({"tally": merge_tallies(shard["tally"] for shard in summary),
+                       "root": mt.get_merkle_root(),
+                       "shards": summary})
+
+
+# endpoint to query the vote counts per venue, candidate and time.
+# Optional query parameters:
+# * `group_by`: comma separated fields among venue, candidate and
+#   bucket (default candidate)
+# * `venue`, `candidate`: only count the votes of this venue / candidate
+# * `from`, `to`: only count the votes cast in this range of unix times
+# * `interval`: width in seconds of the time buckets (default 60)
+# * `cumulative=1`: add up the buckets over time, e.g. for turnout
+# * `shard`: only count the votes of this shard
+@app.route('/stats', methods=['GET'])
+@cached_until_next_block()
+def get_stats():
+    if request.args.get('shard') is not None:
+        selected = requested_chain()
+        if selected is None:
+            return "Unknown shard", 404
+        stats = selected.stats
+    else:
+        stats = VoteStats.merge(chain.stats for _, chain in chains())
+
+    group_by = tuple(field for field in
+                     request.args.get('group_by', 'candidate').split(',') if field)
+    try:
+        rows = stats.query(group_by,
+                           venue=request.args.get('venue'),
+                           candidate=request.args.get('candidate'),
+                           start=request.args.get('from', type=float),
+                           end=request.args.get('to', type=float),
+                           interval=request.args.get('interval', type=int),
+                           cumulative=bool(request.args.get('cumulative')))
+    except ValueError as e:
+        return str(e), 400
+    return json.dumps(rows)
+
+# endpoint to verify a vote receipt. `block_index` and `merkle_root`
+# are optional, the vote hash alone is enough to locate the vote.
 @app.route('/verify_vote', methods=['POST'])
 def verify_vote():
-    block_index = request.get_json()["block_index"]
-    merkle_root = request.get_json()["merkle_root"]
-    leaf_hash = request.get_json()["leaf_hash"]
-
-    if block_index is None or leaf_hash is None:
+    receipt = request.get_json()
+    if not has_string_fields(receipt, ["leaf_hash"]):
         return "Invalid or Missing Parameters", 400
+    block_index = receipt.get("block_index")
+    merkle_root = receipt.get("merkle_root")
+    leaf_hash = receipt["leaf_hash"]
+
+    shard_id, chain, block_index = locate_receipt(leaf_hash, block_index)
+    if block_index is None:
+        if chain.is_pending(leaf_hash):
+            return "Your vote is pending, please verify it again once it has been mined", 202
+        return "Data is not found or has been tampered, verifiaction failed", 400
 
-    try:
-      block = blockchain.chain[block_index]
-    except IndexError:
-      return "Data is not found or has been tampered, verifiaction failed", 400
-    if block.verify_vote(leaf_hash, merkle_root):
-        return "Your vote has been verified", 200
+    if check_receipt(chain, block_index, leaf_hash, merkle_root):
+        if shard_id is not None:
+            return "Your vote has been verified in block {} of shard {}".format(
+                block_index, shard_id), 200
+        return "Your vote has been verified in block {}".format(block_index), 200
     else:
         return "Data is not found or has been tampered, verifiaction failed", 400
 
+
+# endpoint to export the inclusion proof of a vote
+# (`?leaf_hash=<vote hash>`): its Merkle path, the block header and
+# Merkle root, so the receipt can be checked without this node, see
+# verifier.py
+@app.route('/vote_proof', methods=['GET'])
+@cached_until_next_block()
+def get_vote_proof():
+    leaf_hash = request.args.get('leaf_hash')
+    if not leaf_hash:
+        return "Invalid or Missing Parameters", 400
+
+    shard_id, chain, block_index = locate_receipt(leaf_hash)
+    if block_index is None:
+        if chain.is_pending(leaf_hash):
+            return "Your vote is pending, please get its proof once it has been mined", 202
+        return "Data is not found", 404
+
+    block = chain.chain[block_index]
+    header = block.header()
+    document = {"leaf_hash": leaf_hash,
+                "position": chain.locate_vote(leaf_hash)[1],
+                "proof": block.merkle_proof(leaf_hash),
+                "merkle_root": header["merkle_root"],
+                "header": header}
+    if shard_id is not None:
+        document["shard"] = shard_id
+    return json.dumps(document)
+
+
+# endpoint to verify many vote receipts at once, as a JSON array or as
+# NDJSON (one receipt per line) of {"leaf_hash", "block_index",
+# "merkle_root"}, the last two being optional. The receipts are checked
+# block by block so every Merkle tree is only walked once, and one
+# result is streamed back per line as soon as its block is done:
+# {"receipt": <position in the request>, "leaf_hash", "status":
+# "verified" | "pending" | "failed", "block_index"}.
+@app.route('/verify_votes', methods=['POST'])
+def verify_votes():
+    try:
+        if request.mimetype == 'application/x-ndjson':
+            receipts = [json.loads(line) for line in request.stream if line.strip()]
+        else:
+            receipts = json.loads(request.get_data())
+    except ValueError:
+        return "Invalid or Missing Parameters", 400
+    if not isinstance(receipts, list):
+        return "Invalid or Missing Parameters", 400
+
+    shard_order = {shard_id: order for order, (shard_id, _) in enumerate(chains())}
+    unlocated = []
+    located = []
+    for position, receipt in enumerate(receipts):
+        if not isinstance(receipt, dict) or not receipt.get("leaf_hash") or \
+                not isinstance(receipt["leaf_hash"], str):
+            unlocated.append((position, None, None, blockchain, None))
+            continue
+        leaf_hash = receipt["leaf_hash"]
+        shard_id, chain, block_index = locate_receipt(leaf_hash, receipt.get("block_index"))
+        entry = (position, leaf_hash, receipt.get("merkle_root"), chain, shard_id)
+        if block_index is None:
+            unlocated.append(entry)
+        else:
+            order = block_index if isinstance(block_index, int) else -1
+            located.append((shard_order[shard_id], order, block_index, entry))
+    located.sort(key=lambda item: item[:2])
+
+    def result(entry, block_index, status):
+        position, leaf_hash, _, _, shard_id = entry
+        line = {"receipt": position, "leaf_hash": leaf_hash,
+                "status": status, "block_index": block_index}
+        if shard_id is not None:
+            line["shard"] = shard_id
+        return json.dumps(line).encode() + b"\n"
+
+    def generate():
+        for entry in unlocated:
+            pending = entry[1] is not None and entry[3].is_pending(entry[1])
+            yield result(entry, None, "pending" if pending else "failed")
+        for _, _, block_index, entry in located:
+            _, leaf_hash, merkle_root, chain, _ = entry
+            verified = check_receipt(chain, block_index, leaf_hash, merkle_root)
+            yield result(entry, block_index, "verified" if verified else "failed")
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+def locate_receipt(leaf_hash, block_index=None):
+    """
+    Return the (shard id, blockchain, block index) a vote receipt refers
+    to. The block index is looked up from the vote hash if the receipt
+    doesn't carry it, and is None if the vote is not on the chain.
+    """
+    shard_id, chain = chain_of_vote(leaf_hash)
+    if block_index is None:
+        location = chain.locate_vote(leaf_hash)
+        block_index = location[0] if location else None
+    return shard_id, chain, block_index
+
+
+def check_receipt(chain, block_index, leaf_hash, merkle_root):
+    """
+    Check that the vote hash is in the Merkle tree of the block, which is
+    built once per block and reused for every receipt.
+    """
+    if not isinstance(block_index, int) or not 0 <= block_index < len(chain.chain):
+        return False
+    return chain.chain[block_index].verify_vote(leaf_hash, merkle_root)
+
+def mine_and_announce():
+    """
+    Mine a block from the pending transactions and announce it to the
+    network. Returns False if there was nothing to mine. The nonce search
+    runs without holding `chain_lock`, so blocks from peers and syncs
+    aren't held up by it, and the block is only appended if it still
+    extends our tip. Otherwise its transactions are still in the mempool
+    and are mined again on top of the new tip.
+    """
+    while True:
+        mined_chain = blockchain
+        with mined_chain.mining_lock:
+            new_block = mined_chain.seal_block()
+            if new_block is None:
+                return False
+            with chain_lock:
+                # a replaced chain is detached from the chain store
+                stale = mined_chain is not blockchain or \
+                    blockchain.last_block.hash != new_block.previous_hash
+                if not stale and not blockchain.add_block(new_block, new_block.hash):
+                    return False
+            if not stale:
+                break
+
+    # Making sure we have the longest chain before announcing to the network
+    chain_length = len(blockchain.chain)
+    consensus()
+    if chain_length == len(blockchain.chain):
+        # announce the recently mined block to the network
+        announce_new_block(blockchain.last_block)
+    return True
+
+
+def mine_shards():
+    """
+    Mine a block on every shard with pending transactions, all at once.
+    Returns the ids of the shards that got a new block.
+    """
+    mined = shard_executor.map(lambda shard_id: shards[shard_id].mine(), SHARD_IDS)
+    return [shard_id for shard_id, result in zip(SHARD_IDS, mined) if result]
+
+
+def auto_mine(shard_id=None):
+    """
+    Background loop sealing a block whenever a full block worth of
+    transactions is pending, or the oldest one has waited AUTO_MINE_WAIT
+    seconds, so votes get confirmed without anyone calling /mine. Every
+    shard runs its own loop.
+    """
+    while True:
+        time.sleep(1)
+        chain = blockchain if shard_id is None else shards[shard_id]
+        mempool = chain.mempool
+        if len(mempool) >= Blockchain.max_block_transactions or \
+                (len(mempool) and mempool.oldest_age() >= AUTO_MINE_WAIT):
+            try:
+                if shard_id is None:
+                    mine_and_announce()
+                else:
+                    chain.mine()
+            except Exception as error:
+                print("Failed to mine pending transactions", error)
+
+
 def consensus():
     """
-    Our naive consensus algorithm. If a longer valid chain is
-    found, our chain is replaced with it.
+    Our consensus algorithm. Peers first exchange their tip, and we only
+    sync with the longest chain that differs from ours. Only the headers
+    needed to find the last common ancestor, and the blocks after it,
+    are downloaded. Returns True if our chain was changed.
     """
-    global blockchain
+    with CONSENSUS_SECONDS.time():
+        return sync_with_longest_peer()
+
 
-    longest_chain = None
+def sync_with_longest_peer():
     current_len = len(blockchain.chain)
+    candidates = []
+
+    # ask every peer for its tip at once, slow or dead peers are
+    # left out once the client's deadline has passed
+    for node, response in peer_client.fan_out('GET', list(peers), 'tip').items():
+        try:
+            tip = response.json()
+        except ValueError:
+            continue
+        # skip peers whose tip is malformed
+        if not isinstance(tip, dict) or not isinstance(tip.get('height'), int) or \
+                isinstance(tip['height'], bool):
+            continue
+        if tip['height'] + 1 > current_len:
+            candidates.append((tip['height'], node))
+
+    # try the longest chains first, falling back on a peer that fails
+    for _, node in sorted(candidates, reverse=True):
+        try:
+            with CONSENSUS_PEER_SECONDS.time(peer=node):
+                synced = sync_with_peer(node)
+            if synced:
+                return True
+        except (requests.RequestException, ValueError, KeyError, TypeError):
+            continue
 
-    for node in peers:
-        response = requests.get('{}chain'.format(node))
-        length = response.json()['length']
-        chain = response.json()['chain']
-        if length > current_len and blockchain.check_chain_validity(chain):
-            current_len = length
-            longest_chain = chain
+    return False
 
-    if longest_chain:
-        blockchain = longest_chain
-        return True
 
-    return False
+def find_common_ancestor(node):
+    """
+    Return the height of the last block we share with the peer, walking
+    back from our tip over windows of headers that double in size.
+    """
+    tip_height = len(blockchain.chain) - 1
+    window = 1
+    while True:
+        start = max(tip_height - window + 1, 0)
+        response = peer_client.get(node, 'chain',
+                                   params={'from': start, 'to': tip_height,
+                                           'headers': 1})
+        for header in reversed(response.json()['chain']):
+            height = header['index']
+            if height <= tip_height and \
+                    blockchain.chain[height].hash == header['hash']:
+                return height
+        if start == 0:
+            return None
+        window *= 2
+
+
+def sync_with_peer(node):
+    """
+    Fetch the blocks after our last common ancestor with the peer. They
+    are appended to our chain if it is the ancestor itself, otherwise our
+    chain is replaced by the peer's fork if that is longer.
+    """
+    ancestor = find_common_ancestor(node)
+    # the blocks before our snapshot can't be replaced, we don't hold them
+    if ancestor is None or ancestor < blockchain.pruned_height:
+        return False
+    ancestor_hash = blockchain.chain[ancestor].hash
+
+    response = peer_client.get(node, 'chain', params={'from': ancestor + 1},
+                               headers={'Accept': WIRE_ACCEPT})
+    _, new_blocks = read_chain_response(response)
+    if not new_blocks:
+        return False
+
+    with chain_lock:
+        # our chain may have changed while the blocks were downloaded
+        if len(blockchain.chain) <= ancestor or \
+                blockchain.chain[ancestor].hash != ancestor_hash:
+            return False
+
+        if ancestor == blockchain.last_block.index:
+            for block, proof in new_blocks:
+                if not blockchain.add_block(block, proof):
+                    break
+            return blockchain.last_block.index > ancestor
+
+        forked_blockchain = blockchain.fork(ancestor)
+        for block, proof in new_blocks:
+            if not forked_blockchain.add_block(block, proof):
+                return False
+
+        if len(forked_blockchain.chain) <= len(blockchain.chain):
+            return False
+        replace_chain(forked_blockchain)
+        return True
 
 
 def announce_new_block(block):
@@ -389,54 +1878,35 @@ def announce_new_block(block):
     A function to announce to the network once a block has been mined.
     Other blocks can simply verify the proof of work and add it to their
     respective chains.
+    The block is sent in the binary format, and again as JSON to the
+    peers that turn it down as an unsupported media type because they
+    predate it.
     """
-    for peer in peers:
-        url = "{}add_block".format(peer)
+    legacy_peers = [peer for peer in peers if peer in json_only_peers]
+    body = block.to_wire()
+    headers = {'Content-Type': wire.MEDIA_TYPE}
+    if len(body) >= wire.COMPRESS_MIN_BYTES:
+        body = wire.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+    responses = peer_client.fan_out('POST', [peer for peer in peers
+                                             if peer not in json_only_peers],
+                                    'add_block', data=body, headers=headers)
+    rejected = [peer for peer, response in responses.items()
+                if response.status_code == 415]
+    json_only_peers.update(rejected)
+
+    if legacy_peers or rejected:
         headers = {'Content-Type': "application/json"}
-        requests.post(url,
-                      data=json.dumps(block.__dict__, sort_keys=True),
-                      headers=headers)
+        peer_client.fan_out('POST', legacy_peers + rejected, 'add_block',
+                            data=block.to_json(),
+                            headers=headers)
+
+# Seal blocks in the background, set AUTO_MINE=0 to only mine on /mine
+AUTO_MINE_WAIT = float(os.environ.get('AUTO_MINE_WAIT', 10))
+if os.environ.get('AUTO_MINE', '1') == '1':
+    threading.Thread(target=auto_mine, daemon=True).start()
+    for shard_id in SHARD_IDS:
+        threading.Thread(target=auto_mine, args=(shard_id,), daemon=True).start()
 
 # Uncomment this line if you want to specify the port number in the code
 #app.run(debug=True, port=8000)
-
-
-#database to register users
-def register_user(uid):
-  try:
-    sqliteConnection = sqlite3.connect('test.db')
-    cursor = sqliteConnection.cursor()
-
-    sqlite_insert_with_param = """INSERT INTO USERS(uid) VALUES (?);"""
-
-    cursor.execute(sqlite_insert_with_param, (uid,))
-    sqliteConnection.commit()
-    cursor.close()
-  except sqlite3.Error as error:
-    print("Failed to insert Python variable into sqlite table", error)
-  finally:
-        if (sqliteConnection):
-            sqliteConnection.close()
-            print("The SQLite connection is closed")
-
-def is_user_exist(uid):
-  try:
-    result = False
-    sqliteConnection = sqlite3.connect('test.db')
-    cursor = sqliteConnection.cursor()
-
-    sql_select_query = """select * from USERS where uid = ?"""
-    cursor.execute(sql_select_query, (uid,))
-    records = cursor.fetchall()
-    for row in records:
-      if row[1] == uid:
-          result = True
-    cursor.close()
-    sqliteConnection.close()
-  except sqlite3.Error as error:
-    print("Failed to read data from sqlite table", error)
-  finally:
-    if (sqliteConnection):
-      sqliteConnection.close()
-      print("The SQLite connection is closed")
-    return result
\ No newline at end of file
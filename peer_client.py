@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urljoin
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+PEER_REQUEST_SECONDS = metrics.Histogram(
+    'peer_request_seconds', 'Latency of requests sent to peers', ('peer', 'path'))
+PEER_FAILURES = metrics.Counter(
+    'peer_failures_total', 'Requests to peers that failed or timed out', ('peer',))
+PEER_BYTES_SENT = metrics.Counter(
+    'peer_bytes_sent_total', 'Request body bytes sent to each peer', ('peer',))
+PEER_BYTES_RECEIVED = metrics.Counter(
+    'peer_bytes_received_total', 'Response body bytes received from each peer', ('peer',))
+
+
+class PeerClient:
+    """
+    HTTP client used by a node to talk to its peers.
+
+    Every peer gets its own keep-alive session, requests to several peers
+    are dispatched concurrently and bounded by a deadline, and peers that
+    fail are backed off exponentially so a dead node doesn't slow down
+    every round.
+    """
+
+    # (connect, read) timeout of a single request, in seconds
+    timeout = (2, 10)
+    # how long a fan-out waits for the slowest peer, in seconds
+    deadline = 15
+    # backoff after consecutive failures, doubled each time
+    base_backoff = 1
+    max_backoff = 60
+
+    def __init__(self, max_workers=16):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.failures = {}
+        self.retry_at = {}
+        # moving average of the response time of each peer
+        self.latency = {}
+
+    def session(self, peer):
+        with self.lock:
+            session = self.sessions.get(peer)
+            if session is None:
+                session = requests.Session()
+                session.mount('http://', HTTPAdapter(pool_maxsize=4))
+                session.mount('https://', HTTPAdapter(pool_maxsize=4))
+                self.sessions[peer] = session
+            return session
+
+    def is_available(self, peer):
+        return time.time() >= self.retry_at.get(peer, 0)
+
+    def _record_success(self, peer, elapsed):
+        with self.lock:
+            self.failures[peer] = 0
+            self.retry_at.pop(peer, None)
+            previous = self.latency.get(peer)
+            self.latency[peer] = elapsed if previous is None \
+                else 0.8 * previous + 0.2 * elapsed
+
+    def _record_failure(self, peer):
+        with self.lock:
+            failures = self.failures.get(peer, 0) + 1
+            self.failures[peer] = failures
+            backoff = min(self.base_backoff * 2 ** (failures - 1), self.max_backoff)
+            self.retry_at[peer] = time.time() + backoff
+
+    def request(self, method, peer, path, **kwargs):
+        """
+        Send a request to `path` on the peer, raising
+        `requests.RequestException` if it cannot be reached in time.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.time()
+        try:
+            response = self.session(peer).request(method, urljoin(peer, path),
+                                                  **kwargs)
+        except requests.RequestException:
+            self._record_failure(peer)
+            PEER_FAILURES.inc(peer=peer)
+            raise
+        elapsed = time.time() - started
+        self._record_success(peer, elapsed)
+        PEER_REQUEST_SECONDS.observe(elapsed, peer=peer, path=path)
+        PEER_BYTES_SENT.inc(len(response.request.body or b''), peer=peer)
+        PEER_BYTES_RECEIVED.inc(len(response.content), peer=peer)
+        return response
+
+    def get(self, peer, path, **kwargs):
+        return self.request('GET', peer, path, **kwargs)
+
+    def post(self, peer, path, **kwargs):
+        return self.request('POST', peer, path, **kwargs)
+
+    def fan_out(self, method, peers, path, **kwargs):
+        """
+        Send the same request to every peer that is not backed off, all at
+        once. Returns a dict of peer -> response for the peers that
+        answered before the deadline.
+        """
+        futures = {self.executor.submit(self.request, method, peer, path, **kwargs): peer
+                   for peer in peers if self.is_available(peer)}
+        done, _ = wait(futures, timeout=self.deadline)
+
+        responses = {}
+        for future in done:
+            if future.exception() is None:
+                responses[futures[future]] = future.result()
+        return responses
+
+    def health(self, peers=None):
+        """
+        Return the consecutive failures, average latency and availability
+        of the given peers, by default of every peer contacted so far.
+        """
+        with self.lock:
+            return {peer: {"failures": self.failures.get(peer, 0),
+                           "latency": self.latency.get(peer),
+                           "available": time.time() >= self.retry_at.get(peer, 0)}
+                    for peer in (self.sessions if peers is None else peers)}
@@ -0,0 +1,179 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from hashlib import sha256
+import os
+import json
+import threading
+import time
+
+from merkletools import MerkleTools
+
+
+def hash_nonce(prefix, nonce):
+    """
+    A function that returns the block hash for a serialized block prefix
+    (everything up to the nonce value) and a nonce.
+    """
+    return sha256(prefix + b'%d}' % nonce).hexdigest()
+
+
+def block_prefix(index, previous_hash, timestamp, difficulty, merkle_root, state_hash):
+    """
+    A function that returns the serialized block header up to the nonce,
+    which is all of the block that proof of work hashes besides the nonce.
+    """
+    return b'{"index": %d, "previous_hash": %b, "timestamp": %b, ' \
+           b'"difficulty": %d, "merkle_root": %b, "state_hash": %b, ' \
+           b'"nonce": ' % (index, json.dumps(previous_hash).encode(),
+                           json.dumps(timestamp).encode(), difficulty,
+                           json.dumps(merkle_root).encode(),
+                           json.dumps(state_hash).encode())
+
+
+def hash_block(header, encoded_transactions):
+    """
+    Return the (leaf hashes, Merkle root, hash) of a block from its
+    header fields and the canonical bytes of its transactions.
+    """
+    leaf_hashes = [sha256(trx).hexdigest() for trx in encoded_transactions]
+    mt = MerkleTools(hash_type="sha256")
+    mt.add_leaf(leaf_hashes)
+    mt.make_tree()
+    merkle_root = mt.get_merkle_root()
+    prefix = block_prefix(header["index"], header["previous_hash"], header["timestamp"],
+                          header["difficulty"], merkle_root, header["state_hash"])
+    return leaf_hashes, merkle_root, hash_nonce(prefix, header["nonce"])
+
+
+def hash_block_records(records):
+    return [hash_block(header, encoded_transactions)
+            for header, encoded_transactions in records]
+
+
+def search_nonce_range(prefix, difficulty, start, stop):
+    """
+    Try every nonce in [start, stop) and return the first (nonce, hash)
+    satisfying the difficulty, or None. The prefix is hashed only once
+    and its midstate copied for every nonce.
+    """
+    midstate = sha256(prefix)
+    target = '0' * difficulty
+    for nonce in range(start, stop):
+        attempt = midstate.copy()
+        attempt.update(b'%d}' % nonce)
+        computed_hash = attempt.hexdigest()
+        if computed_hash.startswith(target):
+            return nonce, computed_hash
+    return None
+
+
+class ProofOfWorkEngine:
+    """
+    Searches the nonce space in fixed size chunks. Easy difficulties are
+    solved inline, harder ones are split across a process pool and the
+    outstanding chunks are cancelled as soon as one of them succeeds.
+    """
+
+    # number of nonces handed to a worker at a time
+    chunk_size = 20000
+    # below this difficulty the pool costs more than it saves
+    parallel_difficulty = 4
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # statistics of the last search
+        self.hash_rate = 0.0
+        self.last_duration = 0.0
+        self.last_hashes = 0
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def search(self, prefix, difficulty):
+        """
+        Return a (nonce, hash) pair whose hash starts with `difficulty`
+        zeros for the given serialized block prefix.
+        """
+        started = time.time()
+        if self.workers > 1 and difficulty >= self.parallel_difficulty:
+            nonce, computed_hash, hashes = self._search_parallel(prefix, difficulty)
+        else:
+            nonce, computed_hash, hashes = self._search_inline(prefix, difficulty)
+
+        self.last_duration = time.time() - started
+        self.last_hashes = hashes
+        if self.last_duration > 0:
+            self.hash_rate = hashes / self.last_duration
+        return nonce, computed_hash
+
+    def _search_inline(self, prefix, difficulty):
+        start = 0
+        while True:
+            found = search_nonce_range(prefix, difficulty, start,
+                                       start + self.chunk_size)
+            if found is not None:
+                return found[0], found[1], found[0] + 1
+            start += self.chunk_size
+
+    def _search_parallel(self, prefix, difficulty):
+        pool = self._get_pool()
+        in_flight = {}
+        next_start = 0
+        hashes = 0
+        result = None
+
+        while result is None:
+            while len(in_flight) < self.workers * 2:
+                future = pool.submit(search_nonce_range, prefix, difficulty,
+                                     next_start, next_start + self.chunk_size)
+                in_flight[future] = next_start
+                next_start += self.chunk_size
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                start = in_flight.pop(future)
+                found = future.result()
+                if found is None:
+                    hashes += self.chunk_size
+                    continue
+                hashes += found[0] - start + 1
+                if result is None or found[0] < result[0]:
+                    result = found
+
+        for future in in_flight:
+            future.cancel()
+        return result[0], result[1], hashes
+
+    def hash_blocks(self, records, chunk_size=256):
+        """
+        Yield the (leaf hashes, Merkle root, hash) of every (header fields,
+        encoded transactions) record in order, see `hash_block`. Large
+        batches are hashed in chunks across the process pool, so the
+        transactions are hashed into leaves and trees in the workers too;
+        closing the generator early cancels the chunks that haven't
+        started yet.
+        """
+        if self.workers <= 1 or len(records) <= chunk_size:
+            for header, encoded_transactions in records:
+                yield hash_block(header, encoded_transactions)
+            return
+
+        pool = self._get_pool()
+        futures = [pool.submit(hash_block_records, records[start:start + chunk_size])
+                   for start in range(0, len(records), chunk_size)]
+        try:
+            for future in futures:
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def stats(self):
+        return {"workers": self.workers,
+                "hash_rate": self.hash_rate,
+                "last_duration": self.last_duration,
+                "last_hashes": self.last_hashes}
@@ -0,0 +1,79 @@
+"""
+Checkpoint snapshots of the chain state, which let a joining node start
+from a recent height instead of downloading and replaying every block
+before it.
+
+A snapshot holds the height and hash of a block, the cumulative tally,
+voter digest and vote stats once that block was appended, the uids of
+the voters and the vote hashes of every block up to it, grouped by
+block. It is sealed with the hash of its contents, which only guards
+against corruption in transit.
+
+What makes it trustworthy is that every block commits to the state of
+the chain once it is appended, see `state_hash`, and that block hashes
+can be recomputed from the headers. A joining node checks the proof of
+work of every header, the vote hashes against their Merkle roots and
+the tally, voter digest and stats against the state hash of the
+snapshot's block. A snapshot is as trustworthy as the headers, i.e. as
+the proof of work on top of them.
+"""
+from hashlib import sha256
+import json
+
+DIGEST_MODULUS = 2 ** 256
+
+
+def add_voter(digest, uid):
+    """
+    Return `digest` with one more vote by `uid`. The digest is the sum
+    of the hashes of the uids of every vote on the chain, so it doesn't
+    depend on their order and can be carried forward block by block.
+    """
+    return (digest + int(sha256(json.dumps(uid).encode()).hexdigest(), 16)) % DIGEST_MODULUS
+
+
+def state_hash(tally, voter_digest, stats_digest):
+    """
+    Return the hash of the state of the chain once a block is appended:
+    its cumulative tally, voter digest and vote stats digest. Every
+    block commits to it in its header.
+    """
+    return sha256(json.dumps([tally, '{:064x}'.format(voter_digest),
+                              '{:064x}'.format(stats_digest)],
+                             sort_keys=True).encode()).hexdigest()
+
+
+def digest_voters(uids):
+    """
+    Return the voter digest of a list of uids, see `add_voter`.
+    """
+    digest = 0
+    for uid in uids:
+        digest = add_voter(digest, uid)
+    return digest
+
+
+def _content_hash(snapshot):
+    content = {key: value for key, value in snapshot.items()
+               if key != "snapshot_hash"}
+    return sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def seal(height, block_hash, tally, voter_digest, stats, voters, leaves):
+    snapshot = {"height": height,
+                "hash": block_hash,
+                "tally": tally,
+                "voter_digest": '{:064x}'.format(voter_digest),
+                "stats": stats,
+                "voters": voters,
+                "leaves": leaves}
+    snapshot["snapshot_hash"] = _content_hash(snapshot)
+    return snapshot
+
+
+def is_sealed(snapshot):
+    """
+    Check that the contents of the snapshot match the hash it was
+    sealed with.
+    """
+    return snapshot.get("snapshot_hash") == _content_hash(snapshot)
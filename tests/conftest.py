@@ -0,0 +1,128 @@
+import gzip
+import importlib.util
+import os
+import sys
+import tempfile
+from urllib.parse import urlsplit
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# node_server creates its chain store and voter registry in the working
+# directory and starts mining in the background when it is imported
+os.environ['AUTO_MINE'] = '0'
+os.environ.setdefault('CHAIN_STORE', 'chain.db')
+# blocks are mined back to back, keep the difficulty where it starts
+os.environ['TARGET_BLOCK_SECONDS'] = '0'
+os.chdir(tempfile.mkdtemp(prefix='evote-tests-'))
+
+sys.path.insert(0, ROOT)
+
+from chain_store import ChainStore  # noqa: E402
+from peer_client import PeerClient  # noqa: E402
+from voter_registry import VoterRegistry  # noqa: E402
+
+# address `node` reaches the `peer` node at
+PEER = 'http://peer/'
+
+
+class FlaskAdapter(BaseAdapter):
+    """
+    Transport adapter handing the requests of a PeerClient to the Flask
+    test client of another node running in the same process.
+    """
+
+    def __init__(self, app):
+        super().__init__()
+        self.client = app.test_client()
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        result = self.client.open(url.path, method=request.method, query_string=url.query,
+                                  headers=dict(request.headers), data=request.body)
+        response = requests.Response()
+        response.status_code = result.status_code
+        response.headers = CaseInsensitiveDict(result.headers)
+        response._content = result.get_data()
+        if response.headers.get('Content-Encoding') == 'gzip':
+            # requests decompresses responses as it reads them
+            response._content = gzip.decompress(response._content)
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def load_node(name):
+    """
+    Import another instance of node_server, with its own app and state.
+    """
+    previous = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix='evote-tests-'))
+    try:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, 'node_server.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(previous)
+    return module
+
+
+def reset_node(module, directory, monkeypatch):
+    """
+    Give a node an empty chain store, voter registry and peer list in
+    `directory`, as if it had just been started there.
+    """
+    directory.mkdir()
+    registry = VoterRegistry(str(directory / 'test.db'))
+    store = ChainStore(str(directory / 'chain.db'))
+    monkeypatch.setattr(module, 'voter_registry', registry)
+    monkeypatch.setattr(module, 'chain_store', store)
+    monkeypatch.setattr(module, 'blockchain', module.Blockchain.load(store, registry))
+    monkeypatch.setattr(module, 'peers', set())
+    monkeypatch.setattr(module, 'json_only_peers', set())
+    monkeypatch.setattr(module, 'peer_client', PeerClient())
+    return module
+
+
+@pytest.fixture
+def node(tmp_path, monkeypatch):
+    import node_server
+    return reset_node(node_server, tmp_path / 'node', monkeypatch)
+
+
+@pytest.fixture(scope='session')
+def peer_module():
+    return load_node('peer_node_server')
+
+
+@pytest.fixture
+def peer(node, peer_module, tmp_path, monkeypatch):
+    """
+    A second node, which `node` reaches at PEER.
+    """
+    reset_node(peer_module, tmp_path / 'peer', monkeypatch)
+    session = requests.Session()
+    session.mount(PEER, FlaskAdapter(peer_module.app))
+    node.peer_client.sessions[PEER] = session
+    return peer_module
+
+
+def vote(node, uid, candidate, **fields):
+    """
+    Submit a ballot through the node's /new_transaction endpoint.
+    """
+    ballot = dict(name='voter', uid=uid, voted_candidate=candidate, **fields)
+    response = node.app.test_client().post('/new_transaction', json=ballot)
+    assert response.status_code == 201
+    return node.compute_transaction_hash(ballot)
+
+
+def mine(node):
+    assert node.app.test_client().get('/mine').status_code == 200
@@ -0,0 +1,98 @@
+import json
+import sqlite3
+
+from chain_store import ChainStore
+from conftest import mine, vote
+
+
+def mine_blocks(node, count):
+    for block in range(count):
+        vote(node, 'voter-%d-a' % block, 'A', venue_id='1')
+        vote(node, 'voter-%d-b' % block, 'AB'[block % 2], venue_id='2')
+        mine(node)
+
+
+def assert_same_chain(loaded, blockchain):
+    assert [block.hash for block in loaded.chain] == [block.hash for block in blockchain.chain]
+    assert loaded.tally_history == blockchain.tally_history
+    assert loaded.voter_digests == blockchain.voter_digests
+    assert loaded.leaf_index == blockchain.leaf_index
+    assert loaded.stats.rows() == blockchain.stats.rows()
+    assert loaded.stats.digest == blockchain.stats.digest
+
+
+def count_calls(monkeypatch, cls, name):
+    calls = []
+    method = getattr(cls, name)
+
+    def spy(self, block, *args):
+        calls.append(block.index)
+        return method(self, block, *args)
+    monkeypatch.setattr(cls, name, spy)
+    return calls
+
+
+def test_restart_restores_the_chain_and_its_indexes(node):
+    mine_blocks(node, 3)
+    loaded = node.Blockchain.load(node.chain_store, node.voter_registry)
+    assert_same_chain(loaded, node.blockchain)
+
+    node.blockchain = loaded
+    client = node.app.test_client()
+    assert json.loads(client.get('/count_vote').data) == {'A': 5, 'B': 1}
+    assert client.post('/new_transaction', json={'name': 'voter', 'uid': 'voter-0-a',
+                                                 'voted_candidate': 'B'}).status_code == 400
+
+
+def test_blocks_up_to_the_checkpoint_are_not_verified_again(node, monkeypatch):
+    monkeypatch.setattr(ChainStore, 'checkpoint_interval', 2)
+    mine_blocks(node, 5)
+    assert node.chain_store.checkpoint[0] == 4
+
+    verified = count_calls(monkeypatch, node.Blockchain, 'add_block')
+    trusted = count_calls(monkeypatch, node.Blockchain, 'add_stored_block')
+    loaded = node.Blockchain.load(node.chain_store, node.voter_registry)
+    assert trusted == [1, 2, 3, 4]
+    assert verified == [5]
+    assert_same_chain(loaded, node.blockchain)
+    assert node.chain_store.checkpoint[0] == 5
+
+
+def test_a_checkpoint_that_does_not_match_is_dropped(node, monkeypatch):
+    monkeypatch.setattr(ChainStore, 'checkpoint_interval', 2)
+    mine_blocks(node, 4)
+    with node.chain_store.connection:
+        node.chain_store.connection.execute("UPDATE CHECKPOINT SET hash = 'forged'")
+
+    verified = count_calls(monkeypatch, node.Blockchain, 'add_block')
+    loaded = node.Blockchain.load(node.chain_store, node.voter_registry)
+    assert verified == [1, 2, 3, 4]
+    assert_same_chain(loaded, node.blockchain)
+
+
+def test_a_block_that_fails_is_dropped_with_its_successors(node):
+    mine_blocks(node, 4)
+    with node.chain_store.connection:
+        node.chain_store.connection.execute('DELETE FROM CHECKPOINT')
+        # block 3 replaced by block 2
+        node.chain_store.connection.execute(
+            'UPDATE BLOCKS SET data = (SELECT data FROM BLOCKS WHERE idx = 2) WHERE idx = 3')
+
+    loaded = node.Blockchain.load(node.chain_store, node.voter_registry)
+    assert [block.hash for block in loaded.chain] == \
+        [block.hash for block in node.blockchain.chain[:3]]
+    assert loaded.tally == node.blockchain.tally_history[2]
+    assert [header['index'] for header, *_ in node.chain_store.iter_blocks()] == [1, 2]
+
+
+def test_a_store_in_the_older_layout_is_dropped(node, tmp_path):
+    path = str(tmp_path / 'legacy.db')
+    connection = sqlite3.connect(path)
+    connection.execute('CREATE TABLE BLOCKS (idx INTEGER PRIMARY KEY, hash TEXT NOT NULL, '
+                       'data TEXT NOT NULL)')
+    connection.execute("INSERT INTO BLOCKS VALUES (1, 'ab', '{}')")
+    connection.commit()
+    connection.close()
+
+    loaded = node.Blockchain.load(ChainStore(path))
+    assert len(loaded.chain) == 1
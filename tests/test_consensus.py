@@ -0,0 +1,87 @@
+import threading
+
+import flask
+import requests
+
+from conftest import PEER, FlaskAdapter, mine, vote
+
+
+def test_longer_fork_replaces_our_blocks_and_requeues_their_votes(node, peer):
+    orphan = vote(node, 'a1', 'X')
+    mine(node)
+    for uid in ('b1', 'b2', 'b3'):
+        vote(peer, uid, 'Y')
+        mine(peer)
+
+    node.peers.add(PEER)
+    assert node.consensus()
+    assert [block.hash for block in node.blockchain.chain] == \
+        [block.hash for block in peer.blockchain.chain]
+    assert node.blockchain.tally == {'Y': 3}
+    assert node.blockchain.mempool.hashes() == [orphan]
+    assert node.voter_registry.has_voted('b1')
+    # the chain store holds the new chain
+    reloaded = node.Blockchain.load(node.chain_store)
+    assert reloaded.last_block.hash == peer.blockchain.last_block.hash
+
+    # the requeued vote is mined on top of the new chain and announced
+    mine(node)
+    assert node.blockchain.tally == {'Y': 3, 'X': 1}
+    assert peer.blockchain.last_block.hash == node.blockchain.last_block.hash
+
+
+def test_blocks_after_our_tip_are_appended(node, peer):
+    vote(peer, 'b1', 'Y')
+    mine(peer)
+    node.peers.add(PEER)
+    assert node.consensus()
+    blockchain = node.blockchain
+
+    vote(peer, 'b2', 'Z')
+    mine(peer)
+    assert node.consensus()
+    # appended to our chain rather than replacing it
+    assert node.blockchain is blockchain
+    assert node.blockchain.tally == {'Y': 1, 'Z': 1}
+    assert not node.consensus()
+
+
+def test_peers_with_a_malformed_tip_are_skipped(node, peer):
+    broken = flask.Flask('broken')
+    broken.add_url_rule('/tip', 'tip', lambda: flask.jsonify({'height': 'tall'}))
+    session = requests.Session()
+    session.mount('http://broken/', FlaskAdapter(broken))
+    node.peer_client.sessions['http://broken/'] = session
+    vote(peer, 'b1', 'Y')
+    mine(peer)
+
+    node.peers.update(['http://broken/', PEER])
+    assert node.consensus()
+    assert node.blockchain.tally == {'Y': 1}
+
+
+def test_a_block_mined_on_a_stale_tip_is_mined_again(node, monkeypatch):
+    vote(node, 'a1', 'X')
+    search = node.Blockchain.proof_of_work
+    lock_free = []
+
+    def competing_block_lands(block):
+        monkeypatch.setattr(node.Blockchain, 'proof_of_work', staticmethod(search))
+        # the chain isn't locked during the nonce search
+        waiter = threading.Thread(target=lambda: lock_free.append(
+            node.chain_lock.acquire(timeout=1) and node.chain_lock.release() is None))
+        waiter.start()
+        waiter.join()
+        pending, node.blockchain.mempool = node.blockchain.mempool, node.Mempool()
+        node.blockchain.add_new_transaction({'name': 'voter', 'uid': 'b1',
+                                             'voted_candidate': 'Y'})
+        competing = node.blockchain.seal_block()
+        node.blockchain.mempool = pending
+        assert node.blockchain.add_block(competing, competing.hash)
+        return search(block)
+    monkeypatch.setattr(node.Blockchain, 'proof_of_work', staticmethod(competing_block_lands))
+
+    assert node.mine_and_announce()
+    assert lock_free == [True]
+    assert [block.transactions[0]['uid'] for block in node.blockchain.chain[1:]] == ['b1', 'a1']
+    assert len(node.blockchain.mempool) == 0
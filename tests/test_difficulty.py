@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from node_server import Blockchain
+
+
+class FakeBlock:
+    def __init__(self, timestamp, difficulty, index=None):
+        self.timestamp = timestamp
+        self.difficulty = difficulty
+        self.index = index
+
+
+def make_chain(length, seconds, difficulty=3):
+    # a genesis block with no real timestamp, then one block every `seconds`
+    return [FakeBlock(0, difficulty)] + \
+        [FakeBlock(1000 + index * seconds, difficulty) for index in range(1, length)]
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(Blockchain, 'target_block_seconds', 10)
+    monkeypatch.setattr(Blockchain, 'retarget_interval', 10)
+    monkeypatch.setattr(Blockchain, 'min_difficulty', 1)
+    monkeypatch.setattr(Blockchain, 'max_difficulty', 8)
+
+
+def test_difficulty_rises_when_blocks_are_fast():
+    assert Blockchain.required_difficulty(make_chain(20, 1), 20) == 4
+
+
+def test_difficulty_drops_when_blocks_are_slow():
+    assert Blockchain.required_difficulty(make_chain(20, 100), 20) == 2
+
+
+def test_difficulty_holds_near_the_target():
+    assert Blockchain.required_difficulty(make_chain(20, 10), 20) == 3
+    assert Blockchain.required_difficulty(make_chain(20, 30), 20) == 3
+
+
+def test_difficulty_only_changes_on_retarget_heights():
+    chain = make_chain(25, 1)
+    assert Blockchain.required_difficulty(chain, 25) == 3
+    # the first interval would include the genesis timestamp
+    assert Blockchain.required_difficulty(chain, 10) == 3
+
+
+def test_difficulty_is_fixed_without_a_target(monkeypatch):
+    monkeypatch.setattr(Blockchain, 'target_block_seconds', 0)
+    assert Blockchain.required_difficulty(make_chain(20, 1), 20) == 3
+
+
+def test_difficulty_is_clamped():
+    assert Blockchain.required_difficulty(make_chain(20, 1, difficulty=8), 20) == 8
+    assert Blockchain.required_difficulty(make_chain(20, 100, difficulty=1), 20) == 1
+
+
+def test_timestamps_must_increase():
+    chain = make_chain(3, 10)
+    assert Blockchain.is_valid_timestamp(chain, FakeBlock(chain[1].timestamp + 1, 3, 2))
+    assert not Blockchain.is_valid_timestamp(chain, FakeBlock(chain[1].timestamp, 3, 2))
+
+
+def test_timestamps_may_not_be_far_ahead():
+    chain = make_chain(2, 10)
+    assert not Blockchain.is_valid_timestamp(chain, FakeBlock(time.time() + 3600, 3, 2))
@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from conftest import mine, vote
+
+
+@pytest.mark.parametrize('path', ['/chain', '/count_vote', '/chain?headers=1'])
+def test_unchanged_response_is_not_sent_again(node, path):
+    vote(node, 'u1', 'A')
+    mine(node)
+    client = node.app.test_client()
+    first = client.get(path)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    again = client.get(path, headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == etag
+    # a vote that isn't mined yet doesn't change the chain or the count
+    vote(node, 'u2', 'B')
+    assert client.get(path, headers={'If-None-Match': etag}).status_code == 304
+
+    mine(node)
+    changed = client.get(path, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_etag_depends_on_the_request(node):
+    client = node.app.test_client()
+    etag = client.get('/chain').headers['ETag']
+    assert client.get('/chain?headers=1', headers={'If-None-Match': etag}).status_code == 200
+    assert client.get('/chain', headers={'If-None-Match': etag,
+                                         'Accept-Encoding': 'gzip'}).status_code == 200
+
+
+def test_chain_etag_changes_with_the_peers(node):
+    client = node.app.test_client()
+    etag = client.get('/chain').headers['ETag']
+    node.peers.add('http://peer/')
+    response = client.get('/chain', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert json.loads(response.data)['peers'] == ['http://peer/']
@@ -0,0 +1,58 @@
+import json
+
+from mempool import Mempool
+
+
+def test_add_rejects_duplicates():
+    mempool = Mempool()
+    assert mempool.add('h1', {'uid': 'u1'})
+    assert not mempool.add('h1', {'uid': 'u1'})
+    assert len(mempool) == 1
+    assert 'h1' in mempool
+
+
+def test_add_rejects_when_full():
+    mempool = Mempool(max_size=2)
+    assert mempool.add('h1', {'uid': 'u1'})
+    assert mempool.add('h2', {'uid': 'u2'})
+    assert mempool.is_full()
+    assert not mempool.add('h3', {'uid': 'u3'})
+    mempool.discard('h1')
+    assert mempool.add('h3', {'uid': 'u3'})
+    assert mempool.hashes() == ['h2', 'h3']
+
+
+def test_add_encodes_transactions():
+    mempool = Mempool()
+    mempool.add('h1', {'uid': 'u1'})
+    assert mempool.peek(1, 1000) == [('h1', json.dumps({'uid': 'u1'}).encode())]
+
+
+def test_peek_limits_count_in_arrival_order():
+    mempool = Mempool()
+    for i in range(5):
+        mempool.add('h%d' % i, None, b'x' * 10)
+    assert [tx_hash for tx_hash, _ in mempool.peek(3, 1000)] == ['h0', 'h1', 'h2']
+    # peeking doesn't remove anything
+    assert len(mempool) == 5
+
+
+def test_peek_limits_bytes():
+    mempool = Mempool()
+    for i in range(5):
+        mempool.add('h%d' % i, None, b'x' * 10)
+    assert [tx_hash for tx_hash, _ in mempool.peek(10, 25)] == ['h0', 'h1']
+
+
+def test_peek_returns_one_transaction_bigger_than_the_limit():
+    mempool = Mempool()
+    mempool.add('big', None, b'x' * 100)
+    mempool.add('small', None, b'x')
+    assert mempool.peek(10, 50) == [('big', b'x' * 100)]
+
+
+def test_restore_goes_ahead_even_when_full():
+    mempool = Mempool(max_size=1)
+    mempool.add('h1', None, b'1')
+    mempool.restore([('h2', None, b'2'), ('h3', None, b'3'), ('h1', None, b'1')])
+    assert mempool.hashes() == ['h2', 'h3', 'h1']
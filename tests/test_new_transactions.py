@@ -0,0 +1,59 @@
+import json
+
+from conftest import vote
+
+
+def submit(node, ballots, ndjson=False):
+    client = node.app.test_client()
+    if ndjson:
+        response = client.post('/new_transactions', content_type='application/x-ndjson',
+                               data=''.join(json.dumps(ballot) + '\n' for ballot in ballots))
+    else:
+        response = client.post('/new_transactions', json=ballots)
+    assert response.status_code == 200
+    return json.loads(response.data)
+
+
+def ballot(uid, candidate='A'):
+    return {'name': 'voter', 'uid': uid, 'voted_candidate': candidate}
+
+
+def test_one_receipt_per_ballot_in_order(node):
+    vote(node, 'voted', 'A')
+    receipts = submit(node, [ballot('u1'), {'uid': 'u2'}, ballot('u3', ['A']),
+                             ballot('u1', 'B'), ballot('voted'), ballot('u4', 'B')])
+    assert receipts == [
+        {'vote_hash': node.compute_transaction_hash(ballot('u1'))},
+        {'error': 'Invalid transaction data'},
+        {'error': 'Invalid transaction data'},
+        {'error': 'This voter appears twice in the batch'},
+        {'error': 'This voter has been voted'},
+        {'vote_hash': node.compute_transaction_hash(ballot('u4', 'B'))}]
+    assert len(node.blockchain.mempool) == 3
+    assert node.voter_registry.has_voted('u4')
+    assert not node.voter_registry.has_voted('u2')
+
+
+def test_ndjson_ballots(node):
+    receipts = submit(node, [ballot('u1'), ballot('u2')], ndjson=True)
+    assert [receipt['vote_hash'] for receipt in receipts] == \
+        [node.compute_transaction_hash(ballot(uid)) for uid in ('u1', 'u2')]
+
+
+def test_ballots_beyond_the_mempool_room_are_turned_away(node):
+    node.blockchain.mempool.max_size = 2
+    vote(node, 'voted', 'A')
+    receipts = submit(node, [ballot('voted'), ballot('u1'), ballot('u2'), ballot('u3')])
+    # the voter who voted before doesn't take the room of the next one
+    assert receipts[0] == {'error': 'This voter has been voted'}
+    assert 'vote_hash' in receipts[1]
+    assert receipts[2:] == [{'error': 'The node is busy, please submit this vote again later'}] * 2
+    # the ballots turned away can be submitted again later
+    assert not node.voter_registry.has_voted('u2')
+
+
+def test_malformed_batches_are_rejected(node):
+    client = node.app.test_client()
+    assert client.post('/new_transactions', json={'uid': 'u1'}).status_code == 400
+    assert client.post('/new_transactions', data='[',
+                       content_type='application/json').status_code == 400
@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+import snapshot
+from conftest import PEER, mine, vote
+
+
+@pytest.fixture
+def peer_chain(peer, monkeypatch):
+    # the peer has a snapshot at height 4
+    monkeypatch.setattr(peer.Blockchain, 'snapshot_interval', 4)
+    monkeypatch.setattr(peer.Blockchain, 'snapshot_confirmations', 1)
+    for block in range(6):
+        vote(peer, 'voter-%d' % block, 'AB'[block % 3 == 0], venue_id=str(block % 2))
+        mine(peer)
+    assert peer.blockchain.snapshot()['height'] == 4
+    return peer
+
+
+def reseal(latest, **changes):
+    fields = dict(latest, **changes)
+    return snapshot.seal(fields['height'], fields['hash'], fields['tally'],
+                         int(fields['voter_digest'], 16), fields['stats'],
+                         fields['voters'], fields['leaves'])
+
+
+def register(node):
+    return node.app.test_client().post('/register_with', json={'node_address': PEER})
+
+
+def headers(peer, height):
+    response = peer.app.test_client().get('/chain?to={}&headers=1'.format(height))
+    return json.loads(response.data)['chain']
+
+
+def assert_synced(node, peer):
+    assert node.blockchain.last_block.hash == peer.blockchain.last_block.hash
+    assert node.blockchain.tally == peer.blockchain.tally
+    assert node.blockchain.stats.rows() == peer.blockchain.stats.rows()
+
+
+def test_node_joins_from_the_snapshot(node, peer_chain):
+    assert register(node).status_code == 200
+    assert node.blockchain.pruned_height == 4
+    assert_synced(node, peer_chain)
+    # the voters of the pruned blocks can't vote again
+    response = node.app.test_client().post('/new_transaction', json={
+        'name': 'voter', 'uid': 'voter-0', 'voted_candidate': 'A'})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('tamper', [
+    # a vote moved to another candidate
+    lambda latest: reseal(latest, tally={'A': latest['tally']['A'] + 1,
+                                         'B': latest['tally']['B'] - 1}),
+    # a voter left out of the list
+    lambda latest: reseal(latest, voters=latest['voters'][1:]),
+    # vote stats that don't add up
+    lambda latest: reseal(latest, stats=latest['stats'][1:]),
+    # changed without sealing it again
+    lambda latest: dict(latest, tally={}),
+])
+def test_a_forged_snapshot_falls_back_to_a_full_sync(node, peer_chain, tamper):
+    peer_chain.blockchain._snapshot = tamper(peer_chain.blockchain.snapshot())
+    assert register(node).status_code == 200
+    assert node.blockchain.pruned_height == 0
+    assert_synced(node, peer_chain)
+
+
+def test_snapshot_must_match_the_proof_of_work_of_the_headers(node, peer_chain):
+    latest = peer_chain.blockchain.snapshot()
+    chain_headers = headers(peer_chain, 4)
+    node.Blockchain.from_snapshot(latest, chain_headers)
+
+    forged = [dict(header) for header in chain_headers]
+    forged[2]['merkle_root'] = forged[1]['merkle_root']
+    with pytest.raises(node.ChainError):
+        node.Blockchain.from_snapshot(latest, forged)
+    with pytest.raises(node.ChainError):
+        node.Blockchain.from_snapshot(reseal(latest, leaves=latest['leaves'][::-1]),
+                                      chain_headers)
+
+
+def test_a_tampered_chain_after_the_snapshot_is_rejected(node, peer_chain):
+    peer_chain.blockchain.chain[5].nonce += 1
+    assert register(node).status_code == 502
+    assert len(node.blockchain.chain) == 1
@@ -0,0 +1,88 @@
+from merkletools import MerkleTools
+
+import verifier
+
+TRANSACTIONS = [{'name': 'n', 'uid': 'u%d' % i, 'voted_candidate': 'A'} for i in range(5)]
+
+
+def seal(header):
+    # find a nonce for the difficulty of the header, like a miner would
+    header['nonce'] = 0
+    while not verifier.header_hash(header).startswith('0' * header['difficulty']):
+        header['nonce'] += 1
+    header['hash'] = verifier.header_hash(header)
+    return header
+
+
+def make_proof(position=2):
+    tree = MerkleTools(hash_type='sha256')
+    tree.add_leaf([verifier.vote_hash(transaction) for transaction in TRANSACTIONS])
+    tree.make_tree()
+    header = seal({'index': 3, 'previous_hash': '00cd', 'timestamp': 1.5, 'difficulty': 2,
+                   'merkle_root': tree.get_merkle_root(), 'state_hash': 'ef'})
+    return {'leaf_hash': verifier.vote_hash(TRANSACTIONS[position]), 'header': header,
+            'proof': tree.get_proof(position)}
+
+
+def test_valid_proof():
+    document = make_proof()
+    assert verifier.verify_proof(document) == (True, None)
+    assert verifier.verify_proof(document, transaction=TRANSACTIONS[2]) == (True, None)
+
+
+def test_tampered_proof():
+    document = make_proof()
+    document['leaf_hash'] = verifier.vote_hash(TRANSACTIONS[3])
+    assert not verifier.verify_proof(document)[0]
+    document = make_proof()
+    document['proof'] = [{'left': 'zz'}]
+    assert verifier.verify_proof(document) == (False, "the proof is malformed")
+
+
+def test_transaction_must_match():
+    valid, reason = verifier.verify_proof(make_proof(), transaction=TRANSACTIONS[0])
+    assert not valid and 'transaction' in reason
+
+
+def test_header_is_taken_from_the_cached_headers():
+    document = make_proof()
+    cached = dict(document['header'])
+    assert verifier.verify_proof(document, headers=[cached]) == (True, None)
+
+    assert not verifier.verify_proof(document, headers=[])[0]
+    assert not verifier.verify_proof(document, headers=[dict(cached, hash='00cd')])[0]
+    # a node can't swap the Merkle root of a block the client already knows
+    assert not verifier.verify_proof(document, headers=[dict(cached, merkle_root='00')])[0]
+
+
+def test_forged_header_is_rejected():
+    # a proof that is consistent with the Merkle root of its own header
+    # doesn't pass if the header hash doesn't cover that root
+    document = make_proof()
+    forged_hash = verifier.vote_hash({'uid': 'forged'})
+    document.update(leaf_hash=forged_hash, proof=[])
+    document['header']['merkle_root'] = forged_hash
+    assert verifier.verify_proof(document) == (False, "the hash of block 3 is not valid")
+
+
+def test_header_without_proof_of_work_is_rejected():
+    document = make_proof()
+    header = document['header']
+    # a hash computed from the header, without the leading zeros
+    while verifier.header_hash(header).startswith('00'):
+        header['nonce'] += 1
+    header['hash'] = verifier.header_hash(header)
+    assert not verifier.is_valid_header(header)
+    assert not verifier.verify_proof(document)[0]
+    assert not verifier.is_valid_header({'index': 1})
+
+
+def test_check_headers():
+    genesis = {'index': 0, 'previous_hash': '0', 'timestamp': 0, 'difficulty': 2,
+               'merkle_root': None, 'state_hash': 'ab', 'nonce': 0}
+    genesis['hash'] = verifier.header_hash(genesis)
+    block = seal({'index': 1, 'previous_hash': genesis['hash'], 'timestamp': 1,
+                  'difficulty': 1, 'merkle_root': 'cd', 'state_hash': 'ef'})
+    assert verifier.check_headers([genesis, block])
+    assert not verifier.check_headers([genesis, seal(dict(block, previous_hash='x'))])
+    assert not verifier.check_headers([genesis, dict(block, merkle_root='00')])
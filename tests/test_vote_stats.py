@@ -0,0 +1,76 @@
+import pytest
+
+from vote_stats import VoteStats
+
+
+def make_stats():
+    stats = VoteStats()
+    for venue, candidate, timestamp in [('1', 'A', 0), ('1', 'B', 30), ('2', 'A', 70),
+                                        ('2', 'A', 130), ('1', 'A', 150)]:
+        stats.count({'venue_id': venue, 'voted_candidate': candidate,
+                     'timestamp': timestamp}, 1000, 0)
+    return stats
+
+
+def test_query_by_candidate():
+    assert make_stats().query() == [{'candidate': 'A', 'votes': 4},
+                                    {'candidate': 'B', 'votes': 1}]
+
+
+def test_query_by_venue_and_candidate():
+    assert make_stats().query(group_by=('venue', 'candidate')) == [
+        {'venue': '1', 'candidate': 'A', 'votes': 2},
+        {'venue': '1', 'candidate': 'B', 'votes': 1},
+        {'venue': '2', 'candidate': 'A', 'votes': 2}]
+
+
+def test_query_filters():
+    stats = make_stats()
+    assert stats.query(venue='2') == [{'candidate': 'A', 'votes': 2}]
+    assert stats.query(group_by=('venue',), candidate='B') == [{'venue': '1', 'votes': 1}]
+    # buckets overlapping [60, 120)
+    assert stats.query(start=60, end=120) == [{'candidate': 'A', 'votes': 1}]
+
+
+def test_query_interval_and_cumulative():
+    stats = make_stats()
+    assert stats.query(group_by=('bucket',), interval=120) == [
+        {'bucket': 0, 'votes': 3}, {'bucket': 120, 'votes': 2}]
+    assert stats.query(group_by=('candidate', 'bucket'), candidate='A',
+                       cumulative=True) == [
+        {'candidate': 'A', 'bucket': 0, 'votes': 1},
+        {'candidate': 'A', 'bucket': 60, 'votes': 2},
+        {'candidate': 'A', 'bucket': 120, 'votes': 4}]
+
+
+def test_query_rejects_bad_arguments():
+    stats = make_stats()
+    with pytest.raises(ValueError):
+        stats.query(interval=90)
+    with pytest.raises(ValueError):
+        stats.query(group_by=('uid',))
+
+
+def test_votes_without_a_usable_timestamp_use_the_block_timestamp():
+    stats = VoteStats()
+    stats.count({'voted_candidate': 'A', 'timestamp': True}, 90, 0)
+    stats.count({'voted_candidate': ['A']}, 90, 0)
+    assert stats.query(group_by=('bucket',)) == [{'bucket': 60, 'votes': 1}]
+
+
+def test_vote_timestamps_are_kept_between_their_block_and_the_previous_one():
+    stats = VoteStats()
+    for timestamp in (0, 500, 10 ** 9):
+        stats.count({'voted_candidate': 'A', 'timestamp': timestamp}, 250, 130)
+    assert stats.query(group_by=('bucket',)) == [{'bucket': 120, 'votes': 1},
+                                                 {'bucket': 240, 'votes': 2}]
+
+
+def test_digest_follows_the_counts():
+    stats = make_stats()
+    transaction = {'venue_id': '3', 'voted_candidate': 'C', 'timestamp': 10}
+    expected = stats.digest_after([transaction], 20, 0)
+    stats.count(transaction, 20, 0)
+    assert stats.digest == expected == VoteStats.from_rows(stats.rows()).digest
+    stats.count(transaction, 20, 0, votes=-1)
+    assert stats.digest == make_stats().digest
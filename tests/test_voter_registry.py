@@ -0,0 +1,56 @@
+import threading
+
+from voter_registry import VoterRegistry
+
+
+def run_together(target, count=8):
+    """
+    Call `target` from `count` threads released at the same time and
+    return the results.
+    """
+    barrier = threading.Barrier(count)
+    results = []
+
+    def run():
+        barrier.wait()
+        results.append(target())
+    threads = [threading.Thread(target=run) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_a_uid_is_registered_once(tmp_path):
+    registry = VoterRegistry(str(tmp_path / 'test.db'))
+    assert sorted(run_together(lambda: registry.register('u1'))) == [False] * 7 + [True]
+    assert registry.has_voted('u1')
+
+
+def test_registry_sharing_the_database_rejects_the_uid(tmp_path):
+    path = str(tmp_path / 'test.db')
+    first, second = VoterRegistry(path), VoterRegistry(path)
+    assert first.register('u1')
+    # not in the memory of the second registry, but the insert fails
+    assert not second.has_voted('u1')
+    assert not second.register('u1')
+    assert second.has_voted('u1')
+    assert VoterRegistry(path).has_voted('u1')
+
+
+def test_register_many_returns_the_new_uids(tmp_path):
+    path = str(tmp_path / 'test.db')
+    registry = VoterRegistry(path)
+    registry.register('u1')
+    VoterRegistry(path).register('u2')
+    assert registry.register_many(['u1', 'u2', 'u3', 'u3', 'u4']) == {'u3', 'u4'}
+    assert registry.register_many(['u3', 'u5']) == {'u5'}
+
+
+def test_concurrent_ballots_of_a_voter_are_accepted_once(node):
+    ballot = {'name': 'voter', 'uid': 'u1', 'voted_candidate': 'A'}
+    statuses = run_together(
+        lambda: node.app.test_client().post('/new_transaction', json=ballot).status_code)
+    assert sorted(statuses) == [201] + [400] * 7
+    assert len(node.blockchain.mempool) == 1
@@ -0,0 +1,48 @@
+import pytest
+
+import wire
+
+HEADER = {"index": 1, "timestamp": 1.5, "previous_hash": "ab", "difficulty": 2,
+          "state_hash": "cd", "nonce": 7, "hash": "ef"}
+TRANSACTIONS = [b'{"uid": "u1", "voted_candidate": "A"}', b'{}']
+
+
+def test_block_round_trip():
+    assert wire.decode_block(wire.encode_block(HEADER, TRANSACTIONS)) == \
+        (HEADER, TRANSACTIONS)
+
+
+def test_chain_round_trip():
+    blocks = [wire.encode_block(HEADER, TRANSACTIONS), wire.encode_block(HEADER, [])]
+    metadata, decoded = wire.decode_chain(wire.encode_chain({"length": 2}, blocks))
+    assert metadata == {"length": 2}
+    assert decoded == [(HEADER, TRANSACTIONS), (HEADER, [])]
+
+
+def test_compress_round_trip():
+    data = wire.encode_block(HEADER, TRANSACTIONS * 100)
+    assert wire.decompress(wire.compress(data)) == data
+
+
+@pytest.mark.parametrize('cut', [2, 10, -1])
+def test_truncated_block_is_rejected(cut):
+    data = wire.encode_block(HEADER, TRANSACTIONS)
+    with pytest.raises(ValueError):
+        wire.decode_block(data[:cut])
+
+
+def test_transaction_count_past_the_end_is_rejected():
+    data = wire.encode_block(HEADER, [])
+    with pytest.raises(ValueError):
+        wire.decode_block(data[:-4] + b'\x00\x00\x00\x05')
+
+
+def test_header_that_is_not_json_is_rejected():
+    with pytest.raises(ValueError):
+        wire.decode_block(b'\x00\x00\x00\x03abc\x00\x00\x00\x00')
+
+
+def test_truncated_chain_is_rejected():
+    data = wire.encode_chain({"length": 1}, [wire.encode_block(HEADER, TRANSACTIONS)])
+    with pytest.raises(ValueError):
+        wire.decode_chain(data[:-3])
@@ -0,0 +1,150 @@
+"""
+Standalone checker for the vote proofs exported by a node's /vote_proof
+endpoint, so receipts can be verified without the node doing the work.
+
+It only needs the standard library. A proof is checked by hashing the
+vote hash up its Merkle path, the same way MerkleTools.validate_proof
+does in tree.py, and comparing the result with the Merkle root of the
+block header. The header itself is only trusted once its hash, computed
+again the same way the node does, matches and has the proof of work its
+difficulty requires. Given a set of headers cached beforehand, e.g. from
+/chain?headers=1, the header is taken from that set rather than from
+the proof, so the node doesn't need to be trusted or even reachable.
+
+    $ curl "http://localhost:8000/vote_proof?leaf_hash=<vote hash>" > proof.json
+    $ python verifier.py proof.json
+    $ python verifier.py proof.json --headers headers.json --transaction vote.json
+"""
+from hashlib import sha256
+import argparse
+import json
+import sys
+
+
+def vote_hash(transaction):
+    """
+    Return the vote hash of a transaction, as given on its receipt.
+    """
+    return sha256(json.dumps(transaction).encode()).hexdigest()
+
+
+def merkle_root_from_proof(leaf_hash, proof):
+    """
+    Hash `leaf_hash` with every sibling on its Merkle path and return
+    the root it leads to, as a hex digest.
+    """
+    node = bytes.fromhex(leaf_hash)
+    for step in proof:
+        if 'left' in step:
+            node = sha256(bytes.fromhex(step['left']) + node).digest()
+        else:
+            node = sha256(node + bytes.fromhex(step['right'])).digest()
+    return node.hex()
+
+
+def header_hash(header):
+    """
+    Return the hash of a block computed from its header, serialized the
+    same way as Block.hashing_prefix in node_server.py.
+    """
+    prefix = b'{"index": %d, "previous_hash": %b, "timestamp": %b, ' \
+             b'"difficulty": %d, "merkle_root": %b, "state_hash": %b, ' \
+             b'"nonce": ' % (header['index'], json.dumps(header['previous_hash']).encode(),
+                             json.dumps(header['timestamp']).encode(), header['difficulty'],
+                             json.dumps(header['merkle_root']).encode(),
+                             json.dumps(header['state_hash']).encode())
+    return sha256(prefix + b'%d}' % header['nonce']).hexdigest()
+
+
+def is_valid_header(header):
+    """
+    Check that the hash of a block header is computed from its fields and
+    has as many leading zeros as its difficulty. The genesis block is not
+    mined, it only needs the right hash.
+    """
+    try:
+        computed_hash = header_hash(header)
+    except (KeyError, TypeError, ValueError):
+        return False
+    return computed_hash == header['hash'] and \
+        (header['index'] == 0 or computed_hash.startswith('0' * header['difficulty']))
+
+
+def check_headers(headers):
+    """
+    Check that a list of consecutive block headers links up, each one
+    naming the hash of the one before it, and that every hash is valid.
+    """
+    return all(is_valid_header(header) for header in headers) and \
+        all(header['index'] == previous['index'] + 1 and
+            header['previous_hash'] == previous['hash']
+            for previous, header in zip(headers, headers[1:]))
+
+
+def verify_proof(document, headers=None, transaction=None):
+    """
+    Return (True, None) if the vote proof is valid, otherwise (False,
+    reason). With `headers`, the block header of the proof must be one
+    of them. With `transaction`, it must be the vote the proof is for.
+    """
+    leaf_hash = document['leaf_hash']
+    header = document['header']
+    if transaction is not None and vote_hash(transaction) != leaf_hash:
+        return False, "the transaction doesn't match the vote hash"
+
+    if headers is not None:
+        known = {known_header['index']: known_header for known_header in headers}
+        cached = known.get(header['index'])
+        if cached is None:
+            return False, "block {} is not in the headers".format(header['index'])
+        if cached['hash'] != header['hash']:
+            return False, "block {} doesn't match the headers".format(header['index'])
+        header = cached
+    if not is_valid_header(header):
+        return False, "the hash of block {} is not valid".format(header['index'])
+
+    try:
+        computed_root = merkle_root_from_proof(leaf_hash, document['proof'])
+    except (ValueError, KeyError, TypeError):
+        return False, "the proof is malformed"
+    if computed_root != header['merkle_root']:
+        return False, "the proof doesn't lead to the Merkle root of block {}".format(
+            header['index'])
+    return True, None
+
+
+def _load(path):
+    if path == '-':
+        return json.load(sys.stdin)
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('proof', help='vote proof from /vote_proof, - for stdin')
+    parser.add_argument('--headers',
+                        help='cached block headers, e.g. a /chain?headers=1 response')
+    parser.add_argument('--transaction', help='the vote transaction as submitted')
+    args = parser.parse_args()
+
+    headers = None
+    if args.headers:
+        headers = _load(args.headers)
+        if isinstance(headers, dict):
+            headers = headers['chain']
+        if not check_headers(headers):
+            print("The cached headers don't link up")
+            sys.exit(1)
+    transaction = _load(args.transaction) if args.transaction else None
+
+    document = _load(args.proof)
+    valid, reason = verify_proof(document, headers, transaction)
+    if not valid:
+        print("Verification failed: {}".format(reason))
+        sys.exit(1)
+    print("Your vote has been verified in block {}".format(document['header']['index']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+from hashlib import sha256
+import json
+import math
+import threading
+
+from snapshot import DIGEST_MODULUS
+
+GROUPS = ('venue', 'candidate', 'bucket')
+
+
+def _row_digest(key, votes):
+    return int(sha256(json.dumps(list(key) + [votes]).encode()).hexdigest(), 16)
+
+
+def _order(values):
+    # venues and candidates may be missing or of mixed types
+    return tuple((value is None, type(value).__name__, value if value is not None else 0)
+                 for value in values)
+
+
+class VoteStats:
+    """
+    Running vote counts per (venue, candidate, time bucket), updated as
+    blocks are appended to the chain.
+
+    A vote is counted in the bucket of its own timestamp if it carries
+    one, otherwise in the bucket of its block. Its own timestamp is only
+    taken between the timestamps of the previous block and of its block,
+    since it was cast in between, so ballots can't be moved into any
+    other bucket. Queries only go over the
+    aggregated counts, so they cost the same however long the chain is.
+
+    The counts are summed up in `digest`, the sum of the hashes of every
+    (venue, candidate, bucket, votes) row, which is kept up to date vote
+    by vote and committed to by every block, see `snapshot.state_hash`.
+    """
+
+    # width of the time buckets votes are counted in, in seconds
+    bucket_seconds = 60
+
+    def __init__(self, counts=None):
+        self.lock = threading.Lock()
+        # (venue, candidate, bucket start) -> number of votes
+        self.counts = dict(counts or {})
+        self.digest = sum(_row_digest(key, votes)
+                          for key, votes in self.counts.items()) % DIGEST_MODULUS
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls({(venue, candidate, bucket): votes
+                    for venue, candidate, bucket, votes in rows})
+
+    @classmethod
+    def merge(cls, all_stats):
+        """
+        Return the sum of several VoteStats, e.g. of every shard.
+        """
+        counts = {}
+        for stats in all_stats:
+            with stats.lock:
+                for key, votes in stats.counts.items():
+                    counts[key] = counts.get(key, 0) + votes
+        return cls(counts)
+
+    def rows(self):
+        with self.lock:
+            return [[venue, candidate, bucket, votes]
+                    for (venue, candidate, bucket), votes in sorted(
+                        self.counts.items(), key=lambda item: _order(item[0]))]
+
+    def copy(self):
+        with self.lock:
+            return VoteStats(self.counts)
+
+    def _key(self, transaction, block_timestamp, previous_timestamp):
+        # like the tally, only votes for a candidate given as a string count
+        voted_candidate = transaction.get('voted_candidate')
+        if not isinstance(voted_candidate, str):
+            return None
+        timestamp = transaction.get('timestamp')
+        if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool) or \
+                not math.isfinite(timestamp):
+            timestamp = block_timestamp
+        timestamp = max(min(timestamp, block_timestamp), previous_timestamp)
+        bucket = int(timestamp // self.bucket_seconds * self.bucket_seconds)
+        venue = transaction.get('venue_id')
+        if not isinstance(venue, (str, int, type(None))):
+            venue = str(venue)
+        return venue, voted_candidate, bucket
+
+    def _digest_with(self, digest, key, votes):
+        # the digest once the row of `key` goes up by `votes`
+        before = self.counts.get(key, 0)
+        if before:
+            digest -= _row_digest(key, before)
+        if before + votes:
+            digest += _row_digest(key, before + votes)
+        return digest % DIGEST_MODULUS
+
+    def count(self, transaction, block_timestamp, previous_timestamp, votes=1):
+        """
+        Count a confirmed transaction of a block sealed at
+        `block_timestamp` after one sealed at `previous_timestamp`, or
+        take it back with `votes=-1` when its block leaves the chain.
+        """
+        key = self._key(transaction, block_timestamp, previous_timestamp)
+        if key is None:
+            return
+        with self.lock:
+            self.digest = self._digest_with(self.digest, key, votes)
+            remaining = self.counts.get(key, 0) + votes
+            if remaining:
+                self.counts[key] = remaining
+            else:
+                self.counts.pop(key, None)
+
+    def digest_after(self, transactions, block_timestamp, previous_timestamp):
+        """
+        Return what `digest` will be once the transactions of a block
+        are counted, without counting them.
+        """
+        added = {}
+        for transaction in transactions:
+            key = self._key(transaction, block_timestamp, previous_timestamp)
+            if key is not None:
+                added[key] = added.get(key, 0) + 1
+        with self.lock:
+            digest = self.digest
+            for key, votes in added.items():
+                digest = self._digest_with(digest, key, votes)
+        return digest
+
+    def query(self, group_by=('candidate',), venue=None, candidate=None,
+              start=None, end=None, interval=None, cumulative=False):
+        """
+        Return the number of votes per combination of the `group_by`
+        fields, for the votes of the given venue and candidate in the
+        buckets overlapping [start, end). Buckets are merged into
+        `interval` seconds, a multiple of `bucket_seconds`. With `cumulative`, each bucket
+        also counts the votes of the buckets before it.
+        """
+        interval = interval or self.bucket_seconds
+        if interval <= 0 or interval % self.bucket_seconds:
+            raise ValueError("interval must be a multiple of {} seconds".format(
+                self.bucket_seconds))
+        if any(group not in GROUPS for group in group_by):
+            raise ValueError("group_by must be among {}".format(', '.join(GROUPS)))
+
+        totals = {}
+        with self.lock:
+            for (vote_venue, vote_candidate, bucket), votes in self.counts.items():
+                if venue is not None and str(vote_venue) != venue:
+                    continue
+                if candidate is not None and vote_candidate != candidate:
+                    continue
+                if (start is not None and bucket + self.bucket_seconds <= start) or \
+                        (end is not None and bucket >= end):
+                    continue
+                fields = {'venue': vote_venue, 'candidate': vote_candidate,
+                          'bucket': bucket // interval * interval}
+                key = tuple(fields[group] for group in group_by)
+                totals[key] = totals.get(key, 0) + votes
+
+        rows = [dict(zip(group_by, key), votes=votes)
+                for key, votes in sorted(totals.items(), key=lambda item: _order(item[0]))]
+        if cumulative and 'bucket' in group_by:
+            rows.sort(key=lambda row: row['bucket'])
+            running = {}
+            for row in rows:
+                series = tuple(row[group] for group in group_by if group != 'bucket')
+                running[series] = running.get(series, 0) + row['votes']
+                row['votes'] = running[series]
+        return rows
@@ -0,0 +1,71 @@
+import sqlite3
+import threading
+
+from metrics import SQLITE_SECONDS
+
+
+class VoterRegistry:
+    """
+    Registry of the uids that have already voted, backed by the USERS
+    table of test.db.
+
+    A single long-lived connection is shared between request threads,
+    and the registered uids are mirrored in memory so membership checks
+    don't touch the disk. The UNIQUE index on uid makes `register` the
+    one atomic check-and-insert, even across processes sharing the file.
+    """
+
+    def __init__(self, path='test.db'):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS USERS
+               (id INTEGER PRIMARY KEY    AUTOINCREMENT,
+               uid           TEXT    NOT NULL);''')
+        self.connection.execute(
+            'CREATE UNIQUE INDEX IF NOT EXISTS USERS_UID ON USERS(uid);')
+        self.connection.commit()
+        self.voted = {uid for (uid,) in self.connection.execute('SELECT uid FROM USERS')}
+
+    def has_voted(self, uid):
+        """
+        Answer from memory. A uid registered by another process sharing
+        the database may be missed here, but `register` still rejects it.
+        """
+        return uid in self.voted
+
+    def register(self, uid):
+        """
+        Atomically register `uid`. Return False if it has voted before.
+        """
+        if uid in self.voted:
+            return False
+        with self.lock, SQLITE_SECONDS.time(operation='register'):
+            try:
+                with self.connection:
+                    self.connection.execute(
+                        'INSERT INTO USERS(uid) VALUES (?);', (uid,))
+            except sqlite3.IntegrityError:
+                self.voted.add(uid)
+                return False
+            self.voted.add(uid)
+        return True
+
+    def register_many(self, uids):
+        """
+        Register several uids in a single SQLite transaction. Returns the
+        set of uids that were newly registered, the others have voted
+        before.
+        """
+        registered = set()
+        with self.lock, SQLITE_SECONDS.time(operation='register_many'):
+            with self.connection:
+                for uid in uids:
+                    if uid in self.voted or uid in registered:
+                        continue
+                    cursor = self.connection.execute(
+                        'INSERT OR IGNORE INTO USERS(uid) VALUES (?);', (uid,))
+                    if cursor.rowcount == 1:
+                        registered.add(uid)
+            self.voted.update(uids)
+        return registered
@@ -0,0 +1,96 @@
+"""
+Compact binary encoding of blocks and chains exchanged between nodes.
+
+Every record is a 4-byte big-endian length followed by its bytes. A block
+is a record holding its JSON header (every field but the transactions),
+a 4-byte transaction count and one record per transaction holding its
+canonical bytes, so the receiver never has to parse the transactions to
+rebuild the block. A chain is a record holding JSON metadata followed by
+block records until the end of the payload.
+
+Nodes ask for it with `Accept: application/x-evote-blocks`, and send it
+with that Content-Type; peers that don't understand it keep getting
+JSON. Payloads can additionally be gzip compressed (Content-Encoding).
+"""
+import gzip
+import json
+import struct
+
+MEDIA_TYPE = 'application/x-evote-blocks'
+
+# payloads smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+_LENGTH = struct.Struct('>I')
+
+
+def _record(data):
+    return _LENGTH.pack(len(data)) + data
+
+
+def encode_block(header, encoded_transactions):
+    return b''.join([_record(json.dumps(header).encode()),
+                     _LENGTH.pack(len(encoded_transactions))] +
+                    [_record(transaction) for transaction in encoded_transactions])
+
+
+def encode_chain(metadata, encoded_blocks):
+    return _record(json.dumps(metadata).encode()) + b''.join(encoded_blocks)
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.position = 0
+
+    def at_end(self):
+        return self.position >= len(self.data)
+
+    def length(self):
+        if self.position + _LENGTH.size > len(self.data):
+            raise ValueError("Truncated record length")
+        (length,) = _LENGTH.unpack_from(self.data, self.position)
+        self.position += _LENGTH.size
+        return length
+
+    def record(self):
+        length = self.length()
+        if self.position + length > len(self.data):
+            raise ValueError("Truncated record")
+        data = bytes(self.data[self.position:self.position + length])
+        self.position += length
+        return data
+
+    def block(self):
+        header = json.loads(self.record())
+        encoded_transactions = [self.record() for _ in range(self.length())]
+        return header, encoded_transactions
+
+
+def decode_block(data):
+    """
+    Return the (header, encoded transactions) of an encoded block.
+    Raises ValueError if the payload is malformed.
+    """
+    return _Reader(data).block()
+
+
+def decode_chain(data):
+    """
+    Return the metadata and the list of (header, encoded transactions)
+    of an encoded chain. Raises ValueError if the payload is malformed.
+    """
+    reader = _Reader(data)
+    metadata = json.loads(reader.record())
+    blocks = []
+    while not reader.at_end():
+        blocks.append(reader.block())
+    return metadata, blocks
+
+
+def compress(data):
+    return gzip.compress(data, compresslevel=6)
+
+
+def decompress(data):
+    return gzip.decompress(data)